@@ -0,0 +1,114 @@
+#!/usr/bin/python
+
+# =========================== adjust path =====================================
+
+import os
+import sys
+if __name__ == '__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..', 'lib'))
+
+# =========================== imports =========================================
+
+import argparse
+import gc
+import multiprocessing
+import resource
+import struct
+import time
+
+# Mercator
+import Notifications
+import MercatorDefines as d
+
+# =========================== helpers =========================================
+
+
+def dict_unpack(data):
+    """
+    Decodes an IND_RX as MoteHandler did before Notifications: from a list
+    of byte values, to a dictionary.
+    """
+    input_buf = [ord(b) for b in data]
+    [msg_type, length, rssi, flags, pkctr] = \
+        struct.unpack(">BBbBH", ''.join([chr(b) for b in input_buf]))
+    crc      = 1 if flags & (1 << 7) != 0 else 0
+    expected = 1 if flags & (1 << 6) != 0 else 0
+    if crc == 0 or expected == 0:
+        pkctr = 0
+    return {
+        'type':             msg_type,
+        'length':           length,
+        'rssi':             rssi,
+        'crc':              crc,
+        'expected':         expected,
+        'pkctr':            pkctr,
+    }
+
+DECODERS = {
+    'dict':   dict_unpack,
+    'record': Notifications.unpack,
+}
+
+
+def frames():
+    # distinct IND_RX frames, as received from the serial port
+    return [struct.pack('>BBbBH', d.TYPE_IND_RX, 127, -60-(i % 40), 0xc0, i % 1000) for i in range(1000)]
+
+
+def decode_time(decoder, count):
+    data  = frames()
+    gc.disable()
+    try:
+        start = time.time()
+        for i in xrange(count):
+            decoder(data[i % len(data)])
+        return time.time()-start
+    finally:
+        gc.enable()
+
+
+def _retain(decoder, count, conn):
+    # run in a fresh process, so that its peak memory only counts these notifications
+    data   = frames()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    kept   = [decoder(data[i % len(data)]) for i in xrange(count)]
+    after  = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((after-before)*1024.0/len(kept))
+
+
+def retained_bytes(decoder, count):
+    (parent, child) = multiprocessing.Pipe()
+    p = multiprocessing.Process(target=_retain, args=(decoder, count, child))
+    p.start()
+    returnval = parent.recv()
+    p.join()
+    return returnval
+
+# =========================== main ============================================
+
+
+def main():
+
+    # parsing user arguments
+    parser = argparse.ArgumentParser(description="Benchmark the decoding of IND_RX notifications.")
+    parser.add_argument("-n", "--count", help="Notifications decoded per decoder", type=int, default=1000000)
+    args = parser.parse_args()
+
+    sample = frames()[0]
+    print '{0} IND_RX notifications per decoder'.format(args.count)
+    print '{0:<8} {1:>10} {2:>14} {3:>12} {4:>16}'.format(
+        'decoder', 'time (s)', 'notifs/s', 'object (B)', 'retained (B/notif)')
+    for name in sorted(DECODERS):
+        decoder  = DECODERS[name]
+        duration = decode_time(decoder, args.count)
+        print '{0:<8} {1:>10.3f} {2:>14.0f} {3:>12} {4:>16.1f}'.format(
+            name,
+            duration,
+            args.count/duration,
+            sys.getsizeof(decoder(sample)),
+            retained_bytes(decoder, args.count),
+        )
+
+if __name__ == '__main__':
+    main()
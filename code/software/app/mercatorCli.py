@@ -11,11 +11,29 @@ if __name__ == '__main__':
 #============================ imports =========================================
 
 import threading
+import time
+from   multiprocessing.pool import ThreadPool
 
 import OpenCli
 import MoteHandler
+import Notifications
 import MercatorDefines as d
 
+#============================ defines =========================================
+
+FANOUT_WORKERS = 32   # motes sent a request at once by 'all' commands
+MONITOR_PERIOD = 1    # seconds between refreshes of the monitor table
+
+CLEAR_SCREEN   = '\x1b[2J\x1b[H'
+
+# counters of the notifications of each mote
+CNT_NOTIFS     = 'notifs'
+CNT_RX         = 'rx'
+CNT_CRC_ERRORS = 'crcErrors'
+CNT_RSSI_SUM   = 'rssiSum'
+CNT_RSSI_COUNT = 'rssiCount'
+CNT_ALL        = [CNT_NOTIFS, CNT_RX, CNT_CRC_ERRORS, CNT_RSSI_SUM, CNT_RSSI_COUNT]
+
 #============================ body ============================================
 
 
@@ -25,53 +43,65 @@ class MercatorCli(object):
 
     def __init__(self):
 
-        self.dataLock   = threading.Lock()
-        self.motes      = {}
+        self.dataLock        = threading.Lock()
+        self.motes           = {}
+        self.pool            = ThreadPool(FANOUT_WORKERS)
+        self.counterLock     = threading.Lock()
+        self.counters        = {}
+        self.states          = {}
+        self.monitors        = []   # jobs of the running monitor commands
 
-        cli             = OpenCli.OpenCli("Mercator CLI", self._quit_callback)
-        cli.register_command(
+        self.cli             = OpenCli.OpenCli("Mercator CLI", self._quit_callback)
+        self.cli.register_command(
             'connect',
             'c',
             'connect to a mote',
             ['serialport'],
             self._cli_connect
         )
-        cli.register_command(
+        self.cli.register_command(
             'list',
             'l',
             'list motes',
             [],
             self._cli_list
         )
-        cli.register_command(
+        self.cli.register_command(
             'state',
             'st',
             'request state',
             ['serialport'],
             self._cli_state
         )
-        cli.register_command(
+        self.cli.register_command(
             'idle',
             'id',
             'switch radio off',
             ['serialport'],
             self._cli_idle
         )
-        cli.register_command(
+        self.cli.register_command(
             'tx',
             'tx',
             'transmit a number of packets',
             ['serialport'],
             self._cli_tx
         )
-        cli.register_command(
+        self.cli.register_command(
             'rx',
             'rx',
             'start receiving',
             ['serialport'],
             self._cli_rx
         )
-        cli.start()
+        self.cli.register_command(
+            'monitor',
+            'm',
+            'show the notification rates of the motes, instead of each notification',
+            [],
+            self._cli_monitor
+        )
+        self.cli.start()
 
     #======================== public ==========================================
 
@@ -80,14 +110,33 @@ class MercatorCli(object):
     def _cli_connect(self, params):
         serialport = params[0]
 
-        if serialport in self.motes:
-            print 'already connected to {0}'.format(serialport)
-            return
+        with self.dataLock:
+            if serialport in self.motes:
+                print 'already connected to {0}'.format(serialport)
+                return
 
+        with self.counterLock:
+            self.counters[serialport] = dict([(c, 0) for c in CNT_ALL])
+            self.states[serialport]   = None
+
+        # connecting waits for the mote's answer: not under the lock
+        mote = MoteHandler.MoteHandler(
+            serialport,
+            handlers     = {
+                d.TYPE_IND_TXDONE:  self._notif_cb,
+                d.TYPE_IND_RX:      self._rx_cb,
+                d.TYPE_IND_UP:      self._notif_cb,
+            },
+            error_cb     = self._print_notif,
+        )
+        if not mote.isActive:
+            mote.close()
+            with self.counterLock:
+                del self.counters[serialport]
+                del self.states[serialport]
+            return
         with self.dataLock:
-            self.motes[serialport] = MoteHandler.MoteHandler(serialport, self._cb)
-            if not self.motes[serialport].isActive:
-                del self.motes[serialport]
+            self.motes[serialport] = mote
 
     def _cli_list(self):
         output          = []
@@ -98,79 +147,170 @@ class MercatorCli(object):
         print output
 
     def _cli_state(self, params):
-        serialport = params[0]
-
-        if serialport == self.ALL:
-            serialports = self.motes.keys()
-        else:
-            if serialport not in self.motes.keys()+[self.ALL]:
-                print 'not serialport to {0}'.format(serialport)
-                return
-            serialports = [serialport]
-
-        with self.dataLock:
-            for s in serialports:
-                print self.motes[s].send_REQ_ST()
+        for (serialport, status) in self._fanout(params[0], lambda mote: mote.send_REQ_ST()):
+            if status is None:
+                print ' - {0}: no answer\n'.format(serialport)
+            else:
+                self._set_state(serialport, status.status)
+                self._print_notif(serialport, status)
 
     def _cli_idle(self, params):
-        serialport = params[0]
-
-        if serialport == self.ALL:
-            serialports = self.motes.keys()
-        else:
-            if serialport not in self.motes.keys()+[self.ALL]:
-                print 'not serialport to {0}'.format(serialport)
-                return
-            serialports = [serialport]
-
-        with self.dataLock:
-            for s in serialports:
-                self.motes[s].send_REQ_IDLE()
+        for (serialport, _) in self._fanout(params[0], lambda mote: mote.send_REQ_IDLE()):
+            self._set_state(serialport, d.ST_IDLE)
 
     def _cli_tx(self, params):
         serialport = params[0]
 
-        if serialport not in self.motes:
+        with self.dataLock:
+            mote = self.motes.get(serialport)
+        if mote is None:
             print 'not serialport to {0}'.format(serialport)
             return
 
-        with self.dataLock:
-            self.motes[serialport].send_REQ_TX(
+        mote.send_REQ_TX(
+            frequency    = 0x14,
+            txpower      = 0,
+            transctr     = 0x0a0a,
+            nbpackets    = 5,
+            txifdur      = 1000,
+            txpksize     = 100,
+            txfillbyte   = 0x0b,
+        )
+        self._set_state(serialport, d.ST_TX)
+
+    def _cli_rx(self, params):
+        def _rx(mote):
+            mote.send_REQ_RX(
                 frequency    = 0x14,
-                txpower      = 0,
+                srcmac       = [0x11, 0x22, 0x33, 0x44, 0x55, 0x66, 0x77, 0x88],
                 transctr     = 0x0a0a,
-                nbpackets    = 5,
-                txifdur      = 1000,
                 txpksize     = 100,
                 txfillbyte   = 0x0b,
             )
+        for (serialport, _) in self._fanout(params[0], _rx):
+            self._set_state(serialport, d.ST_RX)
+
+    def _cli_monitor(self):
+        job = self.cli.current_job()
+        print 'monitoring, enter "cancel {0}" to stop'.format(job.id)
+
+        with self.counterLock:
+            self.monitors += [job]
+        try:
+            previous     = self._snapshot()
+            lastTime     = time.time()
+            while not job.cancelEvent.wait(MONITOR_PERIOD):
+                current  = self._snapshot()
+                now      = time.time()
+                print CLEAR_SCREEN + self._format_rates(previous, current, now-lastTime)
+                previous = current
+                lastTime = now
+        finally:
+            with self.counterLock:
+                self.monitors.remove(job)
 
-    def _cli_rx(self, params):
-        serialport = params[0]
+    #======================== private =========================================
 
-        if serialport == self.ALL:
-            serialports = self.motes.keys()
-        else:
-            if serialport not in self.motes.keys()+[self.ALL]:
+    def _fanout(self, serialport, request):
+        """
+        Send a request to a mote, or to all of them concurrently.
+
+        :returns: a generator of (serialport, result) tuples, in the order the
+                  motes answer; it stops when the command is cancelled
+        """
+        with self.dataLock:
+            if serialport == self.ALL:
+                motes = self.motes.items()
+            elif serialport in self.motes:
+                motes = [(serialport, self.motes[serialport])]
+            else:
                 print 'not serialport to {0}'.format(serialport)
                 return
-            serialports = [serialport]
 
-        with self.dataLock:
-            for s in serialports:
-                self.motes[s].send_REQ_RX(
-                    frequency    = 0x14,
-                    srcmac       = [0x11, 0x22, 0x33, 0x44, 0x55, 0x66, 0x77, 0x88],
-                    transctr     = 0x0a0a,
-                    txpksize     = 100,
-                    txfillbyte   = 0x0b,
-                )
+        job = self.cli.current_job()
 
-    #======================== private =========================================
+        def _request(item):
+            (serialport, mote) = item
+            if job is not None and job.cancelled():
+                return (serialport, None)
+            return (serialport, request(mote))
+
+        for result in self.pool.imap_unordered(_request, motes):
+            if job is not None and job.cancelled():
+                return
+            yield result
+
+    def _monitoring(self):
+        # notifications are only printed while no monitor command runs
+        with self.counterLock:
+            return any([not job.cancelled() for job in self.monitors])
+
+    def _snapshot(self):
+        with self.counterLock:
+            return (
+                dict([(sp, c.copy()) for (sp, c) in self.counters.items()]),
+                self.states.copy(),
+            )
 
-    def _cb(self, serialport, notif):
+    def _format_rates(self, previous, current, duration):
+        (counters, states) = current
+        output   = []
+        output  += ['{0:<20} {1:<12} {2:>9} {3:>9} {4:>9} {5:>9}'.format(
+            'mote', 'state', 'notifs/s', 'rx/s', 'rssi', 'crc err')]
+        for sp in sorted(counters):
+            delta    = dict([(c, counters[sp][c]-previous[0].get(sp, {}).get(c, 0)) for c in CNT_ALL])
+            if delta[CNT_RSSI_COUNT]:
+                rssi = '{0:.1f}'.format(delta[CNT_RSSI_SUM]/float(delta[CNT_RSSI_COUNT]))
+            else:
+                rssi = '-'
+            if delta[CNT_RX]:
+                crc  = '{0:.1f}%'.format(100.0*delta[CNT_CRC_ERRORS]/delta[CNT_RX])
+            else:
+                crc  = '-'
+            output  += ['{0:<20} {1:<12} {2:>9.1f} {3:>9.1f} {4:>9} {5:>9}'.format(
+                sp,
+                states.get(sp) or '?',
+                delta[CNT_NOTIFS]/duration,
+                delta[CNT_RX]/duration,
+                rssi,
+                crc,
+            )]
+        output  += ['({0} motes, refreshed every {1}s, {2})'.format(
+            len(counters), MONITOR_PERIOD, time.strftime('%H:%M:%S'))]
+        return '\n'.join(output)
+
+    def _set_state(self, serialport, status):
+        with self.counterLock:
+            self.states[serialport] = d.status_num2text(status)
+
+    def _notif_cb(self, serialport, notif):
+        with self.counterLock:
+            self.counters[serialport][CNT_NOTIFS] += 1
+            if   notif.type == d.TYPE_IND_TXDONE:
+                self.states[serialport] = d.status_num2text(d.ST_TXDONE)
+            elif notif.type == d.TYPE_IND_UP:
+                self.states[serialport] = 'UP'
+        if not self._monitoring():
+            self._print_notif(serialport, notif)
+
+    def _rx_cb(self, serialport, notif):
+        with self.counterLock:
+            counters                 = self.counters[serialport]
+            counters[CNT_NOTIFS]    += 1
+            counters[CNT_RX]        += 1
+            if not notif.crc:
+                counters[CNT_CRC_ERRORS] += 1
+            elif notif.expected:
+                counters[CNT_RSSI_SUM]   += notif.rssi
+                counters[CNT_RSSI_COUNT] += 1
+        if not self._monitoring():
+            self._print_notif(serialport, notif)
+
+    def _print_notif(self, serialport, notif):
         output               = []
         output              += [' - {0}'.format(serialport)]
+        if isinstance(notif, Notifications.Notification):
+            notif            = notif.as_dict()
         if isinstance(notif, dict):
             if 'type' in notif:
                 output      += ['    . type             : {0}'.format(d.type_num2text(notif['type']))]
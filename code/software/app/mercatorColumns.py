@@ -0,0 +1,44 @@
+#!/usr/bin/python
+
+# =========================== adjust path =====================================
+
+import os
+import sys
+if __name__ == '__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..', 'lib'))
+
+# =========================== imports =========================================
+
+import argparse
+import time
+
+# Mercator
+import ColumnCache
+
+# =========================== main ============================================
+
+
+def main():
+
+    # parsing user arguments
+    parser = argparse.ArgumentParser(
+        description="Convert datasets to uncompressed column files, for memory-mapped analysis.")
+    parser.add_argument("datasets", help="The datasets, or manifests of segmented datasets", type=str, nargs='+')
+    parser.add_argument("--cache-dir", help="Directory of the column files (default: next to each dataset)",
+                        type=str, default=None)
+    parser.add_argument("--force", help="Convert datasets which are already cached", action="store_true")
+    args = parser.parse_args()
+
+    for dataset in args.datasets:
+        startTime = time.time()
+        cache     = ColumnCache.build(dataset, cache_dir=args.cache_dir, force=args.force)
+        print '{0}: {1} rows in {2} ({3:.1f}s).'.format(
+            dataset,
+            cache.rows,
+            cache.dirname,
+            time.time()-startTime,
+        )
+
+if __name__ == '__main__':
+    main()
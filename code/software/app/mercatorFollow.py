@@ -0,0 +1,68 @@
+#!/usr/bin/python
+
+# =========================== adjust path =====================================
+
+import os
+import sys
+if __name__ == '__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..', 'lib'))
+
+# =========================== imports =========================================
+
+import argparse
+import datetime
+import json
+
+# Mercator
+import RecordStream
+import DatasetWriter
+import MercatorDefines as d
+
+# =========================== main ============================================
+
+
+def main():
+
+    # parsing user arguments
+    parser = argparse.ArgumentParser(description="Follow the records published by a running experiment (--stream).")
+    parser.add_argument("address", help="The address given to --stream", type=str)
+    parser.add_argument("--steps", help="Only print step summaries", action="store_true")
+    args = parser.parse_args()
+
+    sock = RecordStream.connect(args.address)
+    try:
+        for (rec_type, content) in RecordStream.read_records(sock.makefile('rb')):
+            if   rec_type == RecordStream.REC_SETTINGS:
+                print json.dumps(content)
+                if not args.steps:
+                    print DatasetWriter.CSV_HEADER
+            elif rec_type == RecordStream.REC_RX and not args.steps:
+                print '{0},{1},{2},{3},{4},{5},{6},{7},{8}'.format(
+                    datetime.datetime.fromtimestamp(content['timestamp']).strftime(DatasetWriter.TIMESTAMP_FORMAT),
+                    d.format_mac(content['src']),
+                    d.format_mac(content['dst']),
+                    content['channel'],
+                    content['rssi'],
+                    content['crc'],
+                    content['expected'],
+                    content['transctr'],
+                    content['pkctr'],
+                )
+            elif rec_type == RecordStream.REC_STEP:
+                print '# t {0} ch {1} tx {2} {3}: {4}'.format(
+                    content['transaction'],
+                    content['channel'],
+                    content['src'],
+                    'done' if content['txdone'] else 'failed',
+                    ' '.join(['{0}={1}'.format(mac, n) for (mac, n) in sorted(content['rx'].items())]),
+                )
+            elif rec_type == RecordStream.REC_DROPPED:
+                print '# {0} records dropped'.format(content)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+
+# =========================== adjust path =====================================
+
+import os
+import sys
+if __name__ == '__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..', 'lib'))
+
+# =========================== imports =========================================
+
+import argparse
+import time
+
+# Mercator
+import DatasetMerge
+
+# =========================== main ============================================
+
+
+def main():
+
+    # parsing user arguments
+    parser = argparse.ArgumentParser(description="Merge datasets of the same experiment into one, sorted.")
+    parser.add_argument("inputs", help="The datasets to merge, or manifests of segmented datasets", type=str, nargs='+')
+    parser.add_argument("-o", "--output", help="The merged dataset", type=str, required=True)
+    parser.add_argument("--renumber", help="Number the transactions of each dataset after those of the previous ones",
+                        action="store_true")
+    parser.add_argument("--run-rows", help="Rows sorted in memory at once", type=int,
+                        default=DatasetMerge.RUN_ROWS)
+    parser.add_argument("--tmpdir", help="Directory for the temporary sorted runs", type=str, default=None)
+    parser.add_argument("--force", help="Merge datasets with different settings", action="store_true")
+    args = parser.parse_args()
+
+    startTime = time.time()
+    merge     = DatasetMerge.DatasetMerge(
+        args.inputs,
+        args.output,
+        renumber  = args.renumber,
+        run_rows  = args.run_rows,
+        tmpdir    = args.tmpdir,
+        force     = args.force,
+    )
+    merge.run()
+    print '{0} rows written to {1} in {2:.1f}s ({3} sorted runs, {4} duplicates dropped).'.format(
+        merge.rows,
+        args.output,
+        time.time()-startTime,
+        merge.runs,
+        merge.duplicates,
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+
+# =========================== adjust path =====================================
+
+import os
+import sys
+if __name__ == '__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..', 'lib'))
+
+# =========================== imports =========================================
+
+import argparse
+import logging
+import multiprocessing
+import Queue
+import time
+
+# Mercator
+import RecordStream
+import mercatorRunExperiment as mre
+
+# =========================== logging =========================================
+
+logconsole  = logging.getLogger("console")
+logfile     = logging.getLogger()  #root logger
+
+# =========================== constants =======================================
+
+REFRESH_PERIOD  = 5     # how often progress is printed, in s
+
+MSG_PROGRESS    = 'progress'
+MSG_DONE        = 'done'
+MSG_ERROR       = 'error'
+
+# =========================== body ============================================
+
+
+class MercatorMultiSite(object):
+    """
+    Runs one MercatorRunExperiment per (site, experiment id) pair, each in its
+    own process and writing its own dataset, and reports their progress and
+    results on a single console. With --capture, each site records to its
+    own subdirectory; with --stream, each site publishes on its own address
+    (see site_stream_address()).
+    """
+
+    def __init__(self, args, runs):
+
+        # local variables
+        self.queue           = multiprocessing.Queue()
+        self.processes       = {}
+        self.progress        = {}
+        self.results         = {}
+        self.startTime       = time.time()
+
+        # start one process per site
+        for (index, (site, expid)) in enumerate(runs):
+            stream = None
+            if args.stream:
+                stream = site_stream_address(args.stream, site, index)
+            p = multiprocessing.Process(
+                target       = _run_site,
+                args         = (args, site, expid, stream, self.queue),
+                name         = 'Mercator@{0}'.format(site),
+            )
+            p.start()
+            self.processes[site] = p
+            self.progress[site]  = 'connecting'
+            logconsole.info("Started %s (experiment %s).", site, expid)
+            if stream:
+                logconsole.info("Streaming %s records on %s.", site, stream)
+
+        # collect progress until all sites are done
+        lastPrint = 0
+        while len(self.results) < len(self.processes):
+            try:
+                self._handle(*self.queue.get(timeout=REFRESH_PERIOD))
+            except Queue.Empty:
+                self._check_processes()
+            except KeyboardInterrupt:
+                # the sites receive the interruption too and close their datasets
+                logconsole.info("Interrupted, waiting for all sites to close their datasets.")
+            if time.time()-lastPrint >= REFRESH_PERIOD:
+                self._print_progress()
+                lastPrint = time.time()
+
+        for p in self.processes.values():
+            p.join()
+
+        self._print_results()
+
+    # ======================= private =========================================
+
+    def _handle(self, site, msg_type, content):
+        if   msg_type == MSG_PROGRESS:
+            self.progress[site] = 't {0}/{1} ch {2} tx {3}/{4}'.format(
+                content['transaction']+1,
+                content['nbtrans'],
+                content['frequency'],
+                content['transmitter'],
+                content['nbtransmitters'],
+            )
+        elif msg_type == MSG_DONE:
+            self.progress[site] = 'done'
+            self.results[site]  = content
+        elif msg_type == MSG_ERROR:
+            logconsole.error("%s failed: %s", site, content)
+            self.progress[site] = 'failed'
+            self.results[site]  = None
+
+    def _check_processes(self):
+        for (site, p) in self.processes.items():
+            if site not in self.results and not p.is_alive():
+                self._handle(site, MSG_ERROR, 'exited with code {0}'.format(p.exitcode))
+
+    def _print_progress(self):
+        logconsole.info(' | '.join(
+            ['{0}: {1}'.format(site, self.progress[site]) for site in sorted(self.progress)]
+        ))
+
+    def _print_results(self):
+        output  = []
+        output += ['']
+        output += ['All sites done in {0:.0f}s:'.format(time.time()-self.startTime)]
+        for site in sorted(self.results):
+            result = self.results[site]
+            if result is None:
+                output += [' - {0}: failed'.format(site)]
+            else:
+                output += [' - {0}: {1} rows from {2} nodes ({3} unresponsive) in {4:.0f}s, {5}'.format(
+                    site,
+                    result['rows'],
+                    result['nodes'],
+                    result['unresponsive'],
+                    result['duration'],
+                    ', '.join(result['filenames']),
+                )]
+        print '\n'.join(output)
+
+# =========================== helpers =========================================
+
+
+def _run_site(args, site, expid, stream, queue):
+    """
+    Body of a site process: run the experiment and report to the queue.
+    """
+
+    # progress is reported by the parent process
+    logconsole.setLevel(logging.WARNING)
+
+    def _progress_cb(progress):
+        queue.put((site, MSG_PROGRESS, progress))
+
+    startTime = time.time()
+    try:
+        (serialports, expsite) = mre.get_motes(expid)
+        if expsite != site:
+            raise SystemError('experiment {0} runs on {1}'.format(expid, expsite))
+        args.expid = expid
+
+        # the sites may have nodes on the same serial ports
+        if args.capture:
+            args.capture = os.path.join(args.capture, site)
+        args.stream = stream
+        exp = mre.MercatorRunExperiment(
+            args         = args,
+            serialports  = serialports,
+            site         = site,
+            progress_cb  = _progress_cb,
+        )
+    except Exception as err:
+        queue.put((site, MSG_ERROR, str(err)))
+    else:
+        queue.put((site, MSG_DONE, {
+            'rows':         exp.rows,
+            'nodes':        len(exp.motes.macs),
+            'unresponsive': len(exp.unresponsive),
+            'duration':     time.time()-startTime,
+            'filenames':    [f for (f, _) in exp.datasets],
+        }))
+
+
+def site_stream_address(address, site, index):
+    """
+    :returns: the stream address of the index-th site: the UNIX socket path
+              followed by the site name, or the TCP port plus index
+    """
+    if RecordStream.is_unix_address(address):
+        return '{0}.{1}'.format(address, site)
+    (host, port) = RecordStream.parse_tcp_address(address)
+    return '{0}:{1}'.format(host, port+index)
+
+
+def parse_run(run):
+    try:
+        (site, expid) = run.split(':')
+        return (site, int(expid))
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected <site>:<expid>, got {0}'.format(run))
+
+# =========================== main ============================================
+
+
+def main():
+
+    # parsing user arguments
+    parser = argparse.ArgumentParser(description="Run Mercator on several sites at once.")
+    parser.add_argument("runs", help="The experiments to run, as <site>:<expid>", type=parse_run, nargs='+')
+    mre.add_experiment_arguments(parser)
+    args = parser.parse_args()
+
+    sites = [site for (site, _) in args.runs]
+    if len(set(sites)) != len(sites):
+        parser.error("each site can only be given once")
+
+    MercatorMultiSite(args, args.runs)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+
+# =========================== adjust path =====================================
+
+import os
+import sys
+if __name__ == '__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..', 'lib'))
+
+# =========================== imports =========================================
+
+import argparse
+import cProfile
+import pstats
+import threading
+import time
+
+# Mercator
+import MoteHandler
+import Notifications
+import SerialCapture
+import MercatorDefines as d
+
+# =========================== body ============================================
+
+
+class ProfiledMoteHandler(MoteHandler.MoteHandler):
+    """
+    A MoteHandler whose reception thread runs under the profiler.
+    """
+
+    def run(self):
+        self.profiler = cProfile.Profile()
+        self.profiler.runcall(MoteHandler.MoteHandler.run, self)
+
+
+class MercatorReplay(object):
+    """
+    Replays raw serial captures (see the --capture option of
+    mercatorRunExperiment.py) through the MoteHandler receive path, and
+    reports how fast the notifications were decoded.
+    """
+
+    def __init__(self, captures, speed, profile=False):
+
+        # local variables
+        self.dataLock        = threading.Lock()
+        self.counts          = {}
+        self.errors          = 0
+        self.motes           = []
+
+        handler              = ProfiledMoteHandler if profile else MoteHandler.MoteHandler
+        startTime            = time.time()
+        for capture in captures:
+            serialport       = os.path.splitext(os.path.basename(capture))[0]
+            self.motes      += [handler(
+                serialport,
+                handlers     = dict([(t, self._count_cb) for t in Notifications.NOTIFICATIONS]),
+                error_cb     = self._error_cb,
+                source       = SerialCapture.ReplaySource(capture, speed=speed),
+            )]
+        for mh in self.motes:
+            mh.join()
+        self.duration        = time.time()-startTime
+
+    # ======================= public ==========================================
+
+    def report(self):
+        frames      = sum(self.counts.values())
+        crcwrong    = sum([mh.get_stats()[MoteHandler.STAT_UARTNUMRXCRCWRONG] for mh in self.motes])
+        output      = []
+        output     += ['replayed {0} captures in {1:.3f}s'.format(len(self.motes), self.duration)]
+        output     += ['{0} notifications ({1:.0f}/s), {2} frames with a wrong CRC, {3} errors'.format(
+            frames,
+            frames/self.duration if self.duration else 0,
+            crcwrong,
+            self.errors,
+        )]
+        for (msg_type, count) in sorted(self.counts.items()):
+            output += [' - {0:<12}: {1}'.format(d.type_num2text(msg_type), count)]
+        print '\n'.join(output)
+
+    def print_profile(self, limit=20):
+        stats = pstats.Stats(*[mh.profiler for mh in self.motes])
+        stats.sort_stats('cumulative').print_stats(limit)
+
+    # ======================= private =========================================
+
+    def _count_cb(self, serialport, notif):
+        with self.dataLock:
+            self.counts[notif.type] = self.counts.get(notif.type, 0)+1
+
+    def _error_cb(self, serialport, err):
+        with self.dataLock:
+            self.errors += 1
+
+# =========================== main ============================================
+
+
+def main():
+
+    # parsing user arguments
+    parser = argparse.ArgumentParser(description="Replay raw serial captures through the receive path.")
+    parser.add_argument("captures", help="The capture files, one per mote", type=str, nargs='+')
+    parser.add_argument("--speed", help="Replay speed (1=real time)", type=float, default=1.0)
+    parser.add_argument("--fast", help="Replay as fast as possible", action="store_true")
+    parser.add_argument("--profile", help="Profile the reception threads", action="store_true")
+    args = parser.parse_args()
+
+    speed = None if args.fast else args.speed
+
+    replay = MercatorReplay(args.captures, speed, profile=args.profile)
+    replay.report()
+    if args.profile:
+        replay.print_profile()
+
+if __name__ == '__main__':
+    main()
@@ -11,15 +11,20 @@ if __name__ == '__main__':
 # =========================== imports =========================================
 
 import argparse
-import threading
 import json
 import datetime
 import logging.config
-import gzip
 import socket
+import time
 
 # Mercator
 import MoteHandler
+import MoteGroup
+import DatasetWriter
+import ExperimentPlanner
+import NodeHealth
+import NodeResetter
+import RecordStream
 import MercatorDefines as d
 
 # IoT-lab
@@ -38,6 +43,11 @@ logfile     = logging.getLogger()  #root logger
 FIRMWARE_PATH   = "../../firmware/"
 DATASET_PATH    = "./"
 METAS_PATH      = "../../../metas/"
+PLAN_CALIBRATION = "./plan_calibration.json"
+
+CAMPAIGN_PARAMS = ['nbpackets', 'nbtrans', 'txpksize', 'txpower']
+LOCAL_SERIALPORTS = ['/dev/ttyUSB1', '/dev/ttyUSB3']
+
 
 # =========================== body ============================================
 
@@ -47,21 +57,43 @@ class MercatorRunExperiment(object):
     TXIFDUR        = 10                          # inter-frame duration, in ms
     TXFILLBYTE     = 0x0a                        # padding byte
 
-    def __init__(self, args, serialports, site="local"):
+    def __init__(self, args, serialports, site="local", progress_cb=None):
+
+        # the shards write unsegmented parts, merged when the dataset is closed
+        if args.shards > 1 and (args.segment_rows or args.segment_minutes):
+            raise SystemError('--segment-rows and --segment-minutes cannot be used with --shards')
 
         # local variables
-        self.dataLock        = threading.Lock()
         self.transctr        = 0
-        self.motes           = {}
-        self.isTransmitting  = False
         self.site            = site
-        self.freq            = self.FREQUENCIES[0]
-        self.transmitterPort = ""
+        self.progress_cb     = progress_cb
+        self.args            = args
+        self.rows            = 0
         self.nbtrans         = args.nbtrans
         self.nbpackets       = args.nbpackets
         self.txpksize        = args.txpksize
         self.txpower         = args.txpower
         self.experiment_id   = args.expid
+        self.crcErrors       = {}
+        self.anomalies       = set()
+        self.quarantined     = set()
+        self.stepctr         = 0
+        self.verify          = {}
+        self.config          = {}
+        self.phaseTimes      = {}
+        self.txTimes         = None
+        self.planner         = ExperimentPlanner.ExperimentPlanner(PLAN_CALIBRATION)
+        self.health          = NodeHealth.NodeHealth(
+            quarantine_score = args.quarantine_score,
+            reprobe_interval = args.reprobe_interval,
+            event_cb         = self._health_cb,
+        )
+
+        # configurations to run
+        if args.campaign:
+            configs = load_campaign(args.campaign)
+        else:
+            configs = [{}]
 
         # use the file created by auth-cli command
         usr, pwd = iotlab.get_user_credentials()
@@ -69,59 +101,70 @@ class MercatorRunExperiment(object):
         # authenticate through the REST interface
         self.api = iotlab.rest.Api(usr, pwd)
 
-        # connect to motes
-        for s in serialports:
-            logfile.debug("connected to %s", s)
-            self.motes[s]    = MoteHandler.MoteHandler(s, self._cb, reset_cb=self._reset_cb)
-            if not self.motes[s].isActive:
-                raise Exception("Mote {0} is not responding.".format(s))
-
-        # get current datetime
-        now = datetime.datetime.now().strftime("%Y.%m.%d-%H.%M.%S")
-
-        # open file
-        self.file = gzip.open(
-            '{0}{1}-{2}_raw.csv.gz'.format(
-                DATASET_PATH,
-                self.site,
-                now
-            ),
-            'wb'
+        # nodes which stop answering are reset in the background
+        self.resetter        = NodeResetter.NodeResetter(
+            node.node_command,
+            self.api,
+            self.experiment_id,
+            self.site,
         )
 
-        # write settings
-        settings = {
-            "interframe_duration": self.TXIFDUR,
-            "fill_byte": self.TXFILLBYTE,
-            "tx_length": self.txpksize,
-            "tx_count": self.nbpackets,
-            "transaction_count": self.nbtrans,
-            "node_count": len(self.motes),
-            "location": self.site,
-            "channel_count": len(self.FREQUENCIES),
-            "start_date": now,
-            "txpower": self.txpower
-        }
-        json.dump(settings, self.file)
-        self.file.write('\n')
-
-        # write csv header
-        self.file.write('datetime,src,dst,channel,rssi,crc,expected,' +
-                        'transaction_id,pkctr\n')
-
-        try:
-            # start transactions
-            for self.transctr in range(0, self.nbtrans):
-                logconsole.info("Current transaction: %s", self.transctr)
-                self._do_transaction()
-        except (KeyboardInterrupt, socket.error):
-            # print error
-            print('\nExperiment ended before all transactions were done.')
+        # raw serial capture
+        if args.capture and not os.path.isdir(args.capture):
+            os.makedirs(args.capture)
+
+        # live records for local consumers
+        self.stream          = None
+        if args.stream:
+            self.stream      = RecordStream.RecordStreamServer(args.stream)
+            logconsole.info("Streaming records on %s.", args.stream)
+
+        # connect to motes, possibly from several worker processes
+        logconsole.info("Connecting to %d motes.", len(serialports))
+        connectStart         = time.time()
+        if args.shards > 1:
+            self.motes = MoteGroup.ShardedMoteGroup(
+                serialports,
+                nbshards        = args.shards,
+                event_cb        = self._event_cb,
+                connect_timeout = args.connect_timeout,
+                rto_min         = args.rto_min,
+                rto_max         = args.rto_max,
+                capture_dir     = args.capture,
+                stream          = self.stream,
+            )
         else:
-            # print all OK
-            print('\nExperiment ended normally.')
+            self.motes = MoteGroup.MoteGroup(
+                serialports,
+                event_cb        = self._event_cb,
+                connect_timeout = args.connect_timeout,
+                rto_min         = args.rto_min,
+                rto_max         = args.rto_max,
+                capture_dir     = args.capture,
+                stream          = self.stream,
+            )
+        self.unresponsive    = sorted(self.motes.failed.keys())
+        self.phaseTimes[ExperimentPlanner.PHASE_CONNECT] = time.time()-connectStart
+        self._report_connections()
+        if not self.motes.macs:
+            self.motes.close()
+            self.resetter.stop()
+            self._close_stream()
+            raise Exception("None of the {0} motes is responding.".format(len(serialports)))
+
+        # run one dataset per configuration, over the same connections
+        self.datasets        = []
+        try:
+            for (index, config) in enumerate(configs):
+                if len(configs) > 1:
+                    logconsole.info("Configuration %d/%d: %s", index+1, len(configs), config)
+                self._apply_config(config)
+                if not self._run_dataset(index):
+                    break
         finally:
-            self.file.close()
+            self.motes.close()
+            self.resetter.stop()
+            self._close_stream()
 
     # ======================= public ==========================================
 
@@ -135,53 +178,287 @@ class MercatorRunExperiment(object):
 
     def _do_experiment_per_frequency(self, freq):
 
-        for counter, transmitterPort in enumerate(self.motes):
-            self._do_experiment_per_transmitter(freq, transmitterPort)
-            if counter % (1+len(self.motes)/4) == 0:
-                logconsole.info("%d/%d", counter, len(self.motes))
+        ports       = self.health.active(self.motes.ports())
+        self.verify = {}
+        for counter, transmitterPort in enumerate(ports):
+            stepStart      = time.time()
+            suspects       = self.anomalies
+            self.anomalies = set()
+            if self._is_optimistic_step():
+                txdone = self._do_optimistic_step(freq, transmitterPort, suspects)
+            elif self.args.schedule == ExperimentPlanner.SCHEDULE_PIPELINED:
+                txdone = self._do_pipelined_step(freq, transmitterPort)
+            else:
+                txdone = self._do_experiment_per_transmitter(freq, transmitterPort)
+            if self.args.optimistic and txdone is not None:
+                self._check_receptions(transmitterPort, txdone)
+            self._account_step(stepStart)
+            if self.stream is not None and txdone is not None:
+                self._publish_step(freq, transmitterPort, txdone)
+            if counter % (1+len(ports)/4) == 0:
+                logconsole.info("%d/%d", counter, len(ports))
+            if self.progress_cb:
+                self.progress_cb({
+                    'transaction':    self.transctr,
+                    'nbtrans':        self.nbtrans,
+                    'frequency':      freq,
+                    'transmitter':    counter+1,
+                    'nbtransmitters': len(ports),
+                })
+
+        # verify the last step of a pipelined schedule
+        if self.verify:
+            self._check_state(self.verify)
+            self.verify = {}
 
     def _do_experiment_per_transmitter(self, freq, transmitter_port):
 
-        self.transmitterPort = transmitter_port
-        self.freq            = freq
         logfile.debug('freq=%s transmitter_port=%s', freq, transmitter_port)
+        if self._skip_transmitter(transmitter_port):
+            return None
+        ports = self.health.active(self.motes.ports())
 
         # switch all motes to idle
-        for (sp, mh) in self.motes.items():
-            logfile.debug('    switch %s to idle', sp)
-            mh.send_REQ_IDLE()
+        logfile.debug('    switch all motes to idle')
+        self.motes.idle(ports)
 
         # check state, assert that all are idle
-        for (sp, mh) in self.motes.items():
-            status = mh.send_REQ_ST()
-            if status is None or status['status'] != d.ST_IDLE:
-                logfile.warn('Node %s is not in IDLE state.', mh.mac)
+        self._check_state(dict([(sp, d.ST_IDLE) for sp in ports]))
 
         # switch all motes to rx
-        for (sp, mh) in self.motes.items():
-            logfile.debug('    switch %s to RX', sp)
-            mh.send_REQ_RX(
-                frequency         = freq,
-                srcmac            = self.motes[transmitter_port].get_mac(),
-                transctr          = self.transctr,
-                txpksize          = self.txpksize,
-                txfillbyte        = self.TXFILLBYTE,
-            )
+        logfile.debug('    switch all motes to RX')
+        self.motes.rx(ports, **self._rx_args(freq, transmitter_port))
 
         # check state, assert that all are in rx mode
-        for (sp, mh) in self.motes.items():
-            status = mh.send_REQ_ST()
-            if status is None or status['status'] != d.ST_RX:
-                logfile.warn('Node %s is not in RX state.', mh.mac)
+        self._check_state(dict([(sp, d.ST_RX) for sp in ports]))
 
-        # switch tx mote to tx
-        logfile.debug('    switch %s to TX', transmitter_port)
+        # switch tx mote to tx and wait to be done
+        if not self._transmit(freq, transmitter_port):
+            self._check_crc_errors(ports)
+            return False
+
+        # check state, assert numnotifications is expected
+        self._check_state(self._expected_after_tx(ports, transmitter_port))
+        self._check_crc_errors(ports)
+        return True
+
+    def _do_pipelined_step(self, freq, transmitter_port):
+        """
+        Same as _do_experiment_per_transmitter, but each mote is verified for
+        the previous step and prepared for this one as soon as possible,
+        concurrently with the others, instead of one phase at a time over all
+        motes.
+        """
+
+        logfile.debug('freq=%s transmitter_port=%s (pipelined)', freq, transmitter_port)
+        if self._skip_transmitter(transmitter_port):
+            return None
+        ports = self.health.active(self.motes.ports())
+
+        # verify the previous step and switch all motes to RX for this one
+        results = self.motes.prepare(
+            ports,
+            check                 = [sp for sp in ports if not self.resetter.is_resetting(sp)],
+            verify                = self.verify,
+            **self._rx_args(freq, transmitter_port)
+        )
+        for (sp, result) in results.items():
+            for (phase, expected) in [
+                    (MoteGroup.PHASE_VERIFY, self.verify.get(sp)),
+                    (MoteGroup.PHASE_IDLE,   d.ST_IDLE),
+                    (MoteGroup.PHASE_RX,     d.ST_RX),
+                ]:
+                if phase in result:
+                    self._evaluate_state(sp, result[phase], expected)
+        self.verify = {}
+
+        # switch tx mote to tx and wait to be done, verify during the next step
+        txdone = self._transmit(freq, transmitter_port)
+        if txdone:
+            self.verify = self._expected_after_tx(ports, transmitter_port)
+        self._check_crc_errors(ports)
+        return txdone
+
+    def _do_optimistic_step(self, freq, transmitter_port, suspects):
+        """
+        Same as _do_experiment_per_transmitter, but only the motes which
+        showed an anomaly during the previous step (suspects) are switched to
+        idle and have their state checked; all others go straight to RX.
+        """
+
+        logfile.debug('freq=%s transmitter_port=%s (optimistic)', freq, transmitter_port)
+        if self._skip_transmitter(transmitter_port):
+            return None
+
+        # verify the previous step if it was pipelined
+        if self.verify:
+            self._check_state(self.verify)
+            self.verify = {}
+
+        ports    = self.health.active(self.motes.ports())
+        suspects = [sp for sp in ports if sp in suspects]
+        if suspects:
+            logfile.debug('    checking %s', ', '.join(suspects))
+
+        # switch suspect motes to idle
+        if suspects:
+            self.motes.idle(suspects)
+            self._check_state(dict([(sp, d.ST_IDLE) for sp in suspects]))
+
+        # switch all motes to rx
+        self.motes.rx(ports, **self._rx_args(freq, transmitter_port))
+        if suspects:
+            self._check_state(dict([(sp, d.ST_RX) for sp in suspects]))
+
+        # switch tx mote to tx and wait to be done
+        txdone = self._transmit(freq, transmitter_port)
+        if txdone and suspects:
+            expected = self._expected_after_tx(ports, transmitter_port)
+            self._check_state(dict([(sp, expected[sp]) for sp in suspects]))
+        self._check_crc_errors(ports)
+        return txdone
+
+    # ======================= private =========================================
+
+    def _apply_config(self, config):
+        self.config = config
+        for param in CAMPAIGN_PARAMS:
+            setattr(self, param, config.get(param, getattr(self.args, param)))
+
+    def _run_dataset(self, index):
+        """
+        Run all transactions of the current configuration into a new dataset.
+
+        :returns: False if the experiment was interrupted
+        """
+
+        # get current datetime
+        now = datetime.datetime.now().strftime("%Y.%m.%d-%H.%M.%S")
+
+        # settings
+        settings = {
+            "interframe_duration": self.TXIFDUR,
+            "fill_byte": self.TXFILLBYTE,
+            "tx_length": self.txpksize,
+            "tx_count": self.nbpackets,
+            "transaction_count": self.nbtrans,
+            "node_count": len(self.motes.macs),
+            "nodes": [d.format_mac(self.motes.macs[sp]) for sp in self.motes.ports()],
+            "channels": self.FREQUENCIES,
+            "location": self.site,
+            "channel_count": len(self.FREQUENCIES),
+            "start_date": now,
+            "txpower": self.txpower,
+            "unresponsive_nodes": self.unresponsive,
+            "shards": self.args.shards,
+            "quarantine_score": self.args.quarantine_score,
+            "reprobe_interval": self.args.reprobe_interval,
+            "rto_min": self.args.rto_min,
+            "rto_max": self.args.rto_max,
+            "campaign_index": index,
+            "schedule": self.args.schedule,
+            "optimistic": self.args.optimistic,
+            "capture_dir": self.args.capture,
+            "output": self.args.output,
+            "bad_frames": self.args.bad_frames,
+            "segment_rows": self.args.segment_rows,
+            "segment_minutes": self.args.segment_minutes,
+        }
 
-        with self.dataLock:
-            self.waitTxDone       = threading.Event()
-            self.isTransmitting   = True
+        # plan
+        params = plan_params(self.args, self.config, len(self.motes.macs), connect=(index == 0))
+        plan   = self.planner.plan(**params)
+        logconsole.info("Planned duration: %.0fs.", sum(plan.values()))
+
+        # open file, one per configuration of a campaign, even within the same second
+        self.filename        = '{0}{1}-{2}{3}_{4}.csv.gz'.format(
+            DATASET_PATH,
+            self.site,
+            now,
+            '-config{0:02d}'.format(index) if self.args.campaign else '',
+            'bitmap' if self.args.output == DatasetWriter.OUTPUT_BITMAP else 'raw',
+        )
+        self.motes.open_dataset(
+            self.filename,
+            settings,
+            self.args.output,
+            self.args.bad_frames,
+            segment_rows    = self.args.segment_rows,
+            segment_minutes = self.args.segment_minutes,
+        )
+        rssiFile             = DatasetWriter.rssi_filename(self.filename)
+        if self.args.segment_rows or self.args.segment_minutes:
+            self.filename    = DatasetWriter.manifest_filename(self.filename)
+        if self.stream is not None:
+            self.stream.set_header(RecordStream.pack_json(RecordStream.REC_SETTINGS, settings))
+
+        completed = False
+        try:
+            # start transactions
+            for self.transctr in range(0, self.nbtrans):
+                logconsole.info("Current transaction: %s", self.transctr)
+                self._do_transaction()
+        except (KeyboardInterrupt, socket.error):
+            # print error
+            print('\nExperiment ended before all transactions were done.')
+        else:
+            # print all OK
+            print('\nExperiment ended normally.')
+            completed = True
+        finally:
+            try:
+                rows = self.motes.close_dataset()
+            finally:
+                # the RSSI histograms are kept even if the dataset cannot be closed
+                DatasetWriter.write_rssi_histograms(rssiFile, settings, self.motes.rssi_histograms(reset=True))
+            logconsole.info("%d rows written to %s.", rows, self.filename)
+            self.rows     += rows
+            self.datasets += [(self.filename, rows)]
+
+        # compare plan and actual duration, and correct the planner
+        actual          = self.phaseTimes
+        self.phaseTimes = {}
+        logconsole.info("Plan vs. actual:\n%s", '\n'.join(self.planner.format(plan, actual)))
+        if completed:
+            rtts = [r for r in self.motes.rtts(self.motes.ports()).values() if r is not None]
+            self.planner.calibrate(
+                actual,
+                rtt    = sum(rtts)/len(rtts) if rtts else None,
+                **params
+            )
 
-        self.motes[transmitter_port].send_REQ_TX(
+        return completed
+
+    def _skip_transmitter(self, transmitter_port):
+        self._detach_quarantined()
+        self._probe_quarantined()
+        if self.resetter.is_resetting(transmitter_port):
+            logfile.debug('    skip %s, being reset', transmitter_port)
+            return True
+        if self.health.is_quarantined(transmitter_port):
+            logfile.debug('    skip %s, quarantined', transmitter_port)
+            return True
+        return False
+
+    def _rx_args(self, freq, transmitter_port):
+        return {
+            'frequency':          freq,
+            'srcmac':             self.motes.macs[transmitter_port],
+            'transctr':           self.transctr,
+            'txpksize':           self.txpksize,
+            'txfillbyte':         self.TXFILLBYTE,
+        }
+
+    def _transmit(self, freq, transmitter_port):
+        """
+        :returns: True if the transmitter reported IND_TXDONE in time
+        """
+        logfile.debug('    switch %s to TX', transmitter_port)
+        txStart     = time.time()
+        maxwaittime = 3*self.nbpackets*(self.TXIFDUR/1000.0)
+        txdone = self.motes.tx(
+            transmitter_port,
+            maxwaittime,
             frequency             = freq,
             txpower               = self.txpower,
             transctr              = self.transctr,
@@ -190,69 +467,136 @@ class MercatorRunExperiment(object):
             txpksize              = self.txpksize,
             txfillbyte            = self.TXFILLBYTE,
         )
-
-        # wait to be done
-        maxwaittime = 3*self.nbpackets*(self.TXIFDUR/1000.0)
-        self.waitTxDone.wait(maxwaittime)
-        if self.waitTxDone.isSet():
+        self.txTimes = (txStart, time.time())
+        if txdone:
             logfile.debug('done.')
         else:
-            #raise SystemError('timeout when waiting for transmission
-            # to be done (no IND_TXDONE after {0}s)'.format(maxwaittime))
-            return
+            logfile.debug('no IND_TXDONE after %ss.', maxwaittime)
+        return txdone
 
-        # check state, assert numnotifications is expected
-        for (sp, mh) in self.motes.items():
-            status = mh.send_REQ_ST()
-            if sp == transmitter_port:
-                if status is None or status['status'] != d.ST_TXDONE:
-                    logfile.warn('Node %s is not in TXDONE state.', mh.mac)
-            else:
-                if status is None or status['status'] != d.ST_RX:
-                    logfile.warn('Node %s is not in RX state.', mh.mac)
-
-    # ======================= private =========================================
-
-    def _cb(self, serialport, notif):
-
-        if isinstance(notif, dict):
-            if   notif['type'] == d.TYPE_RESP_ST:
-                print 'state {0}'.format(serialport)
-            elif notif['type'] == d.TYPE_IND_TXDONE:
-                with self.dataLock:
-                    # assert self.isTransmitting
-                    self.isTransmitting   = False
-                    self.waitTxDone.set()
-            elif notif['type'] == d.TYPE_IND_RX:
-                timestamp  = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S.%f")
-                src        = d.format_mac(self.motes[self.transmitterPort].get_mac())
-                dst        = d.format_mac(self.motes[serialport].get_mac())
-                frequency  = self.freq
-                rssi       = notif['rssi']
-                crc        = notif['crc']
-                expected   = notif['expected']
-                transctr   = self.transctr
-                pkctr      = notif['pkctr']
-                self.file.write("{0},{1},{2},{3},{4},{5},{6},{7},{8}\n".format(
-                        timestamp,
-                        src,
-                        dst,
-                        frequency,
-                        rssi,
-                        crc,
-                        expected,
-                        transctr,
-                        pkctr,
-                    ))
-            elif notif['type'] == d.TYPE_IND_UP:
-                logfile.debug("Node %s restarted",
-                              d.format_mac(self.motes[serialport].get_mac()))
-
-    def _reset_cb(self, mote):
-        logfile.debug('restarting mote {0}'.format(mote.serialport))
-        mote_url = ".".join([mote.serialport, self.site, "iot-lab.info"])
-        node.node_command(self.api, 'reset', self.experiment_id, [mote_url])
-        logfile.debug('mote {0} restarted'.format(mote.serialport))
+    @staticmethod
+    def _expected_after_tx(ports, transmitter_port):
+        expected = dict([(sp, d.ST_RX) for sp in ports])
+        expected[transmitter_port] = d.ST_TXDONE
+        return expected
+
+    def _check_state(self, expected):
+        ports    = [sp for sp in expected if not self.resetter.is_resetting(sp)]
+        statuses = self.motes.state(ports)
+        for (sp, status) in statuses.items():
+            self._evaluate_state(sp, status, expected[sp])
+        return statuses
+
+    def _evaluate_state(self, serialport, status, expected):
+        if status is None:
+            self.health.record_timeout(serialport)
+        else:
+            self.health.record_answer(serialport)
+        if status is None or status.status != expected:
+            logfile.warn('Node %s is not in %s state.',
+                         self.motes.macs[serialport], d.status_num2text(expected))
+            self.anomalies.add(serialport)
+
+    def _account_step(self, step_start):
+        """
+        Split the duration of a step between the planner phases: everything
+        before the transmission prepares it, everything after verifies it.
+        """
+        now = time.time()
+        if self.txTimes is None:
+            times = [(ExperimentPlanner.PHASE_PREPARE, now-step_start)]
+        else:
+            (txStart, txEnd) = self.txTimes
+            times = [
+                (ExperimentPlanner.PHASE_PREPARE, txStart-step_start),
+                (ExperimentPlanner.PHASE_TX,      txEnd-txStart),
+                (ExperimentPlanner.PHASE_VERIFY,  now-txEnd),
+            ]
+        for (phase, duration) in times:
+            self.phaseTimes[phase] = self.phaseTimes.get(phase, 0)+duration
+        self.txTimes = None
+
+    def _is_optimistic_step(self):
+        if not self.args.optimistic:
+            return False
+        self.stepctr += 1
+        return (self.stepctr-1) % self.args.optimistic != 0
+
+    def _check_receptions(self, transmitter_port, txdone):
+        """
+        Flag the transmitter if it did not complete, and the receivers which
+        got no IND_RX at all, for a check during the next optimistic step.
+        """
+        if not txdone:
+            self.anomalies.add(transmitter_port)
+        receivers = [sp for sp in self.health.active(self.motes.ports()) if sp != transmitter_port]
+        for (sp, count) in self.motes.rx_counts(receivers).items():
+            if count == 0:
+                self.anomalies.add(sp)
+
+    def _check_crc_errors(self, ports):
+        for (sp, stats) in self.motes.stats(ports).items():
+            crcerrors         = stats[MoteHandler.STAT_UARTNUMRXCRCWRONG]
+            self.health.record_crc_errors(sp, crcerrors-self.crcErrors.get(sp, 0))
+            self.crcErrors[sp] = crcerrors
+
+    def _detach_quarantined(self):
+        # stop recording the motes quarantined since the last step, which
+        # would otherwise stay in RX for a transmitter they no longer follow
+        (ports, self.quarantined) = (self.quarantined, set())
+        ports = [sp for sp in sorted(ports) if self.health.is_quarantined(sp)]
+        if ports:
+            self.motes.detach(ports)
+
+    def _probe_quarantined(self):
+        ports = [sp for sp in self.health.step() if not self.resetter.is_resetting(sp)]
+        if not ports:
+            return
+        for (sp, status) in self.motes.state(ports).items():
+            if status is not None:
+                self.health.release(sp)
+
+    def _report_connections(self):
+        logconsole.info("%d/%d motes responsive.",
+                        len(self.motes.macs), len(self.motes.macs)+len(self.motes.failed))
+        for (sp, mac) in sorted(self.motes.macs.items()):
+            logfile.debug("connected to %s (%s)", sp, d.format_mac(mac))
+        for (sp, reason) in sorted(self.motes.failed.items()):
+            logconsole.warn("Mote %s is not responding: %s", sp, reason)
+
+    def _publish_step(self, freq, transmitter_port, txdone):
+        receivers = [sp for sp in self.health.active(self.motes.ports()) if sp != transmitter_port]
+        self.stream.publish(RecordStream.pack_json(RecordStream.REC_STEP, {
+            'transaction':        self.transctr,
+            'channel':            freq,
+            'src':                d.format_mac(self.motes.macs[transmitter_port]),
+            'txdone':             txdone,
+            'rx':                 dict([
+                (d.format_mac(self.motes.macs[sp]), count)
+                for (sp, count) in self.motes.rx_counts(receivers).items()
+            ]),
+        }))
+
+    def _close_stream(self):
+        if self.stream is not None:
+            self.stream.close()
+
+    def _event_cb(self, event, serialport):
+        if   event == MoteGroup.EVENT_UP:
+            logfile.debug("Node %s restarted", serialport)
+            self.resetter.done(serialport)
+            self.health.record_restart(serialport)
+            self.anomalies.add(serialport)
+        elif event == MoteGroup.EVENT_RESET:
+            logfile.debug('restarting mote {0}'.format(serialport))
+            self.resetter.request(serialport)
+
+    def _health_cb(self, event, serialport, score):
+        if   event == NodeHealth.EVENT_QUARANTINE:
+            logconsole.warn("Node %s quarantined (score %.1f).", serialport, score)
+            self.quarantined.add(serialport)
+        elif event == NodeHealth.EVENT_RELEASE:
+            logconsole.info("Node %s released from quarantine.", serialport)
 
     @staticmethod
     def _quit_callback():
@@ -261,6 +605,74 @@ class MercatorRunExperiment(object):
 # ========================== helpers ==========================================
 
 
+def plan_params(args, config, nbnodes, connect=True):
+    """
+    :returns: the parameters of ExperimentPlanner.plan() for one configuration
+    """
+    return {
+        'nbnodes':            nbnodes,
+        'nbtrans':            config.get('nbtrans', args.nbtrans),
+        'nbpackets':          config.get('nbpackets', args.nbpackets),
+        'nbfrequencies':      len(MercatorRunExperiment.FREQUENCIES),
+        'txifdur':            MercatorRunExperiment.TXIFDUR,
+        'schedule':           args.schedule,
+        'optimistic':         args.optimistic,
+        'shards':             args.shards,
+        'connect':            connect,
+    }
+
+
+def plan_experiment(args, nbnodes):
+    """
+    Print the planned duration of an experiment, and the duration to reserve.
+    """
+    planner = ExperimentPlanner.ExperimentPlanner(PLAN_CALIBRATION)
+    if args.campaign:
+        configs = load_campaign(args.campaign)
+    else:
+        configs = [{}]
+    plans   = []
+    for (index, config) in enumerate(configs):
+        plan    = planner.plan(**plan_params(args, config, nbnodes, connect=(index == 0)))
+        plans  += [plan]
+        print 'Configuration {0}/{1} on {2} nodes: {3}'.format(index+1, len(configs), nbnodes, config)
+        print '\n'.join(planner.format(plan))
+    print 'Recommended reservation: --duration {0}'.format(planner.recommend_duration(plans))
+
+
+def count_nodes(args):
+    """
+    :returns: the number of nodes an experiment will run on
+    """
+    if args.testbed == "local":
+        return len(LOCAL_SERIALPORTS)
+    elif args.expid is not None:
+        return len(get_motes(args.expid)[0])
+    elif args.nbnodes != 0:
+        return args.nbnodes
+    else:
+        with open("{0}states.json".format(METAS_PATH)) as tb_file:
+            tb_json = json.load(tb_file)
+        return len([x for x in tb_json[args.testbed] if args.board in x])
+
+
+def load_campaign(filename):
+    """
+    Load a campaign file: a JSON list of configurations, each a dictionary
+    overriding some of the CAMPAIGN_PARAMS given on the command line, e.g.
+    [{"txpower": 0}, {"txpower": -17, "txpksize": 20}].
+    """
+    with open(filename) as f:
+        configs = json.load(f)
+    if not isinstance(configs, list) or not configs:
+        raise SystemError('{0} does not contain a list of configurations'.format(filename))
+    for config in configs:
+        unknown = set(config)-set(CAMPAIGN_PARAMS)
+        if unknown:
+            raise SystemError('unknown campaign parameters {0}'.format(', '.join(sorted(unknown))))
+    return configs
+
+
 def get_motes(expid):
     # use the file created by auth-cli command
     usr, pwd    = iotlab.get_user_credentials()
@@ -318,6 +730,48 @@ def submit_experiment(args):
 
     return expid
 
+
+def add_experiment_arguments(parser):
+    """
+    Add the arguments which configure a MercatorRunExperiment to a parser.
+    """
+    parser.add_argument("-p", "--nbpackets", help="The number of packet per transaction", type=int, default=100)
+    parser.add_argument("-t", "--nbtrans", help="The number of transaction", type=int, default=1)
+    parser.add_argument("-s", "--txpksize", help="The size of each packet in bytes", type=int, default=100)
+    parser.add_argument("--txpower", help="The transmission power (dBm)", type=int, default=0)
+    parser.add_argument("--connect-timeout", help="Deadline for connecting to all motes (s)", type=int,
+                        default=MoteHandler.CONNECT_TIMEOUT)
+    parser.add_argument("--rto-min", help="Lower bound of the response timeout (s)", type=float,
+                        default=MoteHandler.RTO_MIN)
+    parser.add_argument("--rto-max", help="Upper bound of the response timeout (s)", type=float,
+                        default=MoteHandler.RTO_MAX)
+    parser.add_argument("--quarantine-score", help="Health score at which a node is quarantined", type=float,
+                        default=NodeHealth.QUARANTINE_SCORE)
+    parser.add_argument("--reprobe-interval", help="Steps between probes of a quarantined node", type=int,
+                        default=NodeHealth.REPROBE_INTERVAL)
+    parser.add_argument("--shards", help="The number of worker processes handling the motes", type=int, default=1)
+    parser.add_argument("--schedule", help="How motes are prepared for each transmitter", type=str,
+                        choices=ExperimentPlanner.SCHEDULE_ALL, default=ExperimentPlanner.SCHEDULE_SEQUENTIAL)
+    parser.add_argument("--optimistic", help="Only check motes which misbehaved, except every M steps (0=always check)",
+                        type=int, default=0, metavar='M')
+    parser.add_argument("--capture", help="A directory to record the raw serial stream of each mote to", type=str,
+                        default=None)
+    parser.add_argument("--output", help="One row per received packet, or one reception bitmap per link and step",
+                        choices=[DatasetWriter.OUTPUT_ROWS, DatasetWriter.OUTPUT_BITMAP],
+                        default=DatasetWriter.OUTPUT_ROWS)
+    parser.add_argument("--bad-frames", help="Write frames with a wrong CRC or from another transmitter as rows, "
+                                             "or count them per link and step in a separate file",
+                        choices=[DatasetWriter.BAD_FRAMES_ROWS, DatasetWriter.BAD_FRAMES_COUNT],
+                        default=DatasetWriter.BAD_FRAMES_ROWS)
+    parser.add_argument("--segment-rows", help="Start a new dataset segment every N rows (0=never)",
+                        type=int, default=0, metavar='N')
+    parser.add_argument("--segment-minutes", help="Start a new dataset segment every M minutes (0=never)",
+                        type=float, default=0, metavar='M')
+    parser.add_argument("--stream", help="Publish records live on a local TCP (host:port) or UNIX socket (path)",
+                        type=str, default=None, metavar='ADDRESS')
+    parser.add_argument("--campaign", help="A JSON file listing the configurations to run back-to-back", type=str,
+                        default=None)
+
 # =========================== main ============================================
 
 
@@ -331,16 +785,16 @@ def main():
     parser.add_argument("-e", "--expid", help="The experiment id", type=int, default=None)
     parser.add_argument("-b", "--board", help="The type of board to use", type=str, default="m3")
     parser.add_argument("-n", "--nbnodes", help="The number of nodes to use (0=all)", type=int, default=0)
-    parser.add_argument("-p", "--nbpackets", help="The number of packet per transaction", type=int, default=100)
-    parser.add_argument("-t", "--nbtrans", help="The number of transaction", type=int, default=1)
-    parser.add_argument("-s", "--txpksize", help="The size of each packet in bytes", type=int, default=100)
-    parser.add_argument("--txpower", help="The transmission power (dBm)", type=int, default=0)
+    parser.add_argument("--plan", help="Only print the planned duration of the experiment", action="store_true")
+    add_experiment_arguments(parser)
     args = parser.parse_args()
 
-    if args.testbed == "local":
+    if args.plan:
+        plan_experiment(args, count_nodes(args))
+    elif args.testbed == "local":
         MercatorRunExperiment(
             args = args,
-            serialports = ['/dev/ttyUSB1', '/dev/ttyUSB3'],
+            serialports = LOCAL_SERIALPORTS,
         )
     else:
         if args.expid is None:
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+
+# =========================== adjust path =====================================
+
+import os
+import sys
+if __name__ == '__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..', 'lib'))
+
+# =========================== imports =========================================
+
+import argparse
+import glob
+import multiprocessing
+import time
+
+# Mercator
+import DatasetReader
+import RssiHistogram
+
+# =========================== constants =======================================
+
+DATASET_PATTERNS = ['*_raw.csv.gz', '*_bitmap.csv.gz', '*.manifest.json']
+PERCENTILES      = [10, 50, 90]
+
+SUMMARY_HEADER   = ','.join(
+    ['dataset', 'src', 'dst', 'channel', 'received', 'pdr', 'rssi_mean', 'rssi_std'] +
+    ['rssi_p{0}'.format(p) for p in PERCENTILES] +
+    ['first', 'last']
+)
+
+STATUS_CACHED     = 'cached'
+STATUS_SUMMARIZED = 'summarized'
+STATUS_FAILED     = 'failed'
+
+# =========================== body ============================================
+
+
+class MercatorSummarize(object):
+    """
+    Summarizes all datasets of a directory, one per process, into a single
+    CSV file with one row per dataset, link and channel.
+
+    The summary of each dataset is kept in a cache directory and only
+    recomputed when the dataset is newer.
+    """
+
+    def __init__(self, directory, output, processes=None, force=False):
+
+        # local variables
+        self.cache_dir       = os.path.join(directory, DatasetReader.CACHE_DIRNAME)
+        self.datasets        = find_datasets(directory)
+        self.summaries       = {}
+        self.failed          = []
+        startTime            = time.time()
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # summarize each dataset
+        pool = multiprocessing.Pool(processes)
+        try:
+            jobs = [(f, self.cache_dir, force) for f in self.datasets]
+            for (i, (filename, summary, status, info)) in enumerate(pool.imap_unordered(_summarize_job, jobs)):
+                print '[{0}/{1}] {2}: {3} ({4})'.format(i+1, len(jobs), os.path.basename(filename), status, info)
+                if status == STATUS_FAILED:
+                    self.failed     += [filename]
+                else:
+                    self.summaries[filename] = summary
+        finally:
+            pool.close()
+            pool.join()
+
+        # merge the summaries
+        rows = 0
+        with open(output, 'w') as out:
+            out.write(SUMMARY_HEADER + '\n')
+            for filename in sorted(self.summaries):
+                with open(self.summaries[filename]) as f:
+                    for line in f:
+                        out.write(line)
+                        rows += 1
+        print '{0} rows from {1} datasets written to {2} in {3:.1f}s ({4} failed).'.format(
+            rows,
+            len(self.summaries),
+            output,
+            time.time()-startTime,
+            len(self.failed),
+        )
+
+# =========================== helpers =========================================
+
+
+def find_datasets(directory):
+    """
+    :returns: the datasets of a directory, excluding segments of segmented datasets
+    """
+    returnval = set()
+    for pattern in DATASET_PATTERNS:
+        returnval |= set(glob.glob(os.path.join(directory, pattern)))
+    return sorted(returnval)
+
+
+def summary_filename(cache_dir, filename):
+    return os.path.join(cache_dir, os.path.basename(filename) + '.summary.csv')
+
+
+def is_up_to_date(summary, filename):
+    if not os.path.exists(summary):
+        return False
+    files = [filename] + DatasetReader.dataset_files(filename)
+    return os.path.getmtime(summary) >= max([os.path.getmtime(f) for f in files])
+
+
+def summarize(filename):
+    """
+    The PDR of a link is computed over the steps of its transmitter on its
+    channel found in the dataset, so a partial run is not penalized for the
+    transactions it did not get to; a step nobody heard is not counted.
+
+    :returns: the summary rows of a dataset, one per link and channel
+    """
+    reader  = DatasetReader.DatasetReader(filename)
+    links   = {}
+    steps   = {}
+    for (timestamp, src, dst, channel, transctr, rssis) in reader.links():
+        steps.setdefault((src, channel), set()).add(transctr)
+        key = (src, dst, channel)
+        if key not in links:
+            links[key] = {'histogram': RssiHistogram.RssiHistogram(), 'first': timestamp, 'last': timestamp}
+        link = links[key]
+        for rssi in rssis:
+            link['histogram'].add(rssi)
+        link['first'] = min(link['first'], timestamp)
+        link['last']  = max(link['last'], timestamp)
+
+    dataset = os.path.basename(filename)
+    rows    = []
+    for ((src, dst, channel), link) in sorted(links.items()):
+        h     = link['histogram']
+        sent  = reader.settings['tx_count']*len(steps[(src, channel)])
+        rows += [','.join([str(v) for v in [
+            dataset, src, dst, channel, h.count(),
+            '{0:.4f}'.format(h.count()/float(sent)),
+            '{0:.2f}'.format(h.mean()),
+            '{0:.2f}'.format(h.std()),
+        ] + [h.quantile(p/100.0) for p in PERCENTILES] + [link['first'], link['last']]])]
+    return rows
+
+
+def _summarize_job(job):
+    """
+    Body of a worker process: summarize a dataset unless its summary is up to date.
+    """
+    (filename, cache_dir, force) = job
+    summary = summary_filename(cache_dir, filename)
+    try:
+        if not force and is_up_to_date(summary, filename):
+            return (filename, summary, STATUS_CACHED, 'up to date')
+        startTime = time.time()
+        rows      = summarize(filename)
+        with open(summary + '.tmp', 'w') as f:
+            for row in rows:
+                f.write(row + '\n')
+        os.rename(summary + '.tmp', summary)
+        return (filename, summary, STATUS_SUMMARIZED, '{0} links in {1:.1f}s'.format(len(rows), time.time()-startTime))
+    except Exception as err:
+        return (filename, summary, STATUS_FAILED, str(err))
+
+# =========================== main ============================================
+
+
+def main():
+
+    # parsing user arguments
+    parser = argparse.ArgumentParser(description="Summarize all datasets of a directory per link and channel.")
+    parser.add_argument("directory", help="The directory holding the datasets", type=str, nargs='?', default='./')
+    parser.add_argument("-o", "--output", help="The summary file", type=str, default='summary.csv')
+    parser.add_argument("-p", "--processes", help="Number of worker processes (default: one per CPU)", type=int,
+                        default=None)
+    parser.add_argument("-f", "--force", help="Summarize all datasets, even those already summarized",
+                        action="store_true")
+    args = parser.parse_args()
+
+    MercatorSummarize(args.directory, args.output, args.processes, args.force)
+
+if __name__ == '__main__':
+    main()
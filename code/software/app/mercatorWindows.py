@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+# =========================== adjust path =====================================
+
+import os
+import sys
+if __name__ == '__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..', 'lib'))
+
+# =========================== imports =========================================
+
+import argparse
+import datetime
+
+# Mercator
+import DatasetReader
+import DatasetWriter
+import LinkWindows
+
+# =========================== constants =======================================
+
+WINDOWS_HEADER = ','.join(
+    ['start', 'end', 'src', 'dst', 'channel', 'sent', 'received', 'pdr', 'rssi_mean', 'rssi_std'] +
+    ['rssi_p{0}'.format(p) for p in LinkWindows.PERCENTILES]
+)
+
+# =========================== helpers =========================================
+
+
+def format_bound(value, by):
+    if by == LinkWindows.BY_TIME:
+        return datetime.datetime.fromtimestamp(value).strftime(DatasetWriter.TIMESTAMP_FORMAT)
+    return str(int(value))
+
+
+def write_windows(out, windows, by):
+    for w in windows:
+        out.write('{0},{1},{2},{3},{4},{5},{6},{7:.4f},{8:.2f},{9:.2f},{10}\n'.format(
+            format_bound(w['start'], by),
+            format_bound(w['end'], by),
+            w['src'],
+            w['dst'],
+            w['channel'],
+            w['sent'],
+            w['received'],
+            w['pdr'],
+            w['rssi_mean'],
+            w['rssi_std'],
+            ','.join([str(w['rssi_p{0}'.format(p)]) for p in LinkWindows.PERCENTILES]),
+        ))
+    return len(windows)
+
+# =========================== main ============================================
+
+
+def main():
+
+    # parsing user arguments
+    parser = argparse.ArgumentParser(description="Link statistics over tumbling or sliding windows.")
+    parser.add_argument("dataset", help="The dataset, or the manifest of a segmented dataset", type=str)
+    parser.add_argument("--by", help="Count windows in transactions or in seconds",
+                        choices=[LinkWindows.BY_TRANSACTION, LinkWindows.BY_TIME], default=LinkWindows.BY_TRANSACTION)
+    parser.add_argument("--size", help="Window size, in transactions or seconds", type=float, required=True)
+    parser.add_argument("--slide", help="Start a window every SLIDE transactions or seconds (default: tumbling)",
+                        type=float, default=None)
+    parser.add_argument("-o", "--output", help="The output file", type=str, default='windows.csv')
+    args = parser.parse_args()
+
+    reader  = DatasetReader.DatasetReader(args.dataset)
+    windows = LinkWindows.LinkWindows(
+        args.size,
+        args.slide,
+        args.by,
+        reader.settings['tx_count'],
+        reader.settings.get('transaction_count'),
+        reader.scheduled_links(),
+    )
+    rows    = 0
+    with open(args.output, 'w') as out:
+        out.write(WINDOWS_HEADER + '\n')
+        for link in reader.links():
+            rows += write_windows(out, windows.add(*link), args.by)
+        rows += write_windows(out, windows.flush(), args.by)
+    print '{0} rows written to {1} ({2} late receptions ignored).'.format(rows, args.output, windows.late)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import array
+import shutil
+import binascii
+import struct
+
+import DatasetReader
+import DatasetWriter
+
+CACHE_VERSION = 1        # changes invalidate all column caches
+FLUSH_ROWS    = 1 << 16  # rows buffered per column before writing
+
+# columns of a cache: name, array typecode (fixed width, native byte order)
+COLUMNS = [
+    ('timestamp',   'd'),  # seconds since the epoch
+    ('src',         'H'),  # index in macs
+    ('dst',         'H'),  # index in macs
+    ('channel',     'B'),
+    ('rssi',        'b'),
+    ('crc',         'B'),
+    ('expected',    'B'),
+    ('transaction', 'I'),
+    ('pkctr',       'H'),
+]
+
+# NumPy dtype of each typecode, without byte order
+DTYPES = {
+    'd': 'f8',
+    'H': 'u2',
+    'B': 'u1',
+    'b': 'i1',
+    'I': 'u4',
+}
+
+
+class ColumnCache(object):
+    """
+    The receptions of a dataset, uncompressed, as one file of fixed-width
+    values per column, which readers map in memory: values are read from
+    the page cache without gunzipping or parsing the dataset again, and
+    processes analysing the same dataset share the same pages.
+
+    A cache is a directory holding a <column>.bin file per column of
+    COLUMNS and a meta.json file with the settings of the dataset, the
+    number of rows, the MAC address of each src/dst index and the byte
+    order. It is written by build().
+    """
+
+    def __init__(self, dirname):
+
+        # slot params
+        self.dirname              = dirname
+
+        # local variables
+        with open(os.path.join(dirname, 'meta.json')) as f:
+            self.meta             = json.load(f)
+        self.settings             = self.meta['settings']
+        self.macs                 = self.meta['macs']
+        self.rows                 = self.meta['rows']
+        self.byteorder            = '<' if self.meta['byteorder'] == 'little' else '>'
+
+    #======================== public ==========================================
+
+    def column(self, name):
+        """
+        :returns: a read-only numpy.memmap of a column, with one value per row
+        """
+        import numpy as np
+        if not self.rows:
+            return np.zeros(0, dtype=self.dtype(name))
+        return np.memmap(self.filename(name), dtype=self.dtype(name), mode='r', shape=(self.rows,))
+
+    def columns(self):
+        """
+        :returns: a dictionary of the numpy.memmap of each column
+        """
+        return dict([(name, self.column(name)) for (name, _) in COLUMNS])
+
+    def dtype(self, name):
+        return self.byteorder + DTYPES[dict(COLUMNS)[name]]
+
+    def filename(self, name):
+        return os.path.join(self.dirname, '{0}.bin'.format(name))
+
+#============================ helpers =========================================
+
+
+def build(filename, cache_dir=None, force=False):
+    """
+    Convert a dataset to a column cache, unless it is already cached.
+
+    Caches are directories in cache_dir (by default the
+    DatasetReader.CACHE_DIRNAME directory next to the dataset), named after
+    the dataset. A cache is rebuilt when the size or modification time of
+    the files of the dataset changed.
+
+    Datasets with one row per packet are converted as they are. Bitmap
+    datasets only hold the packets received correctly, which are expanded
+    to one row each, with crc and expected set.
+
+    :returns: a ColumnCache
+    """
+
+    reader = DatasetReader.DatasetReader(filename)
+    if reader.settings is None:
+        raise SystemError('{0} has no data'.format(filename))
+    if reader.output not in [DatasetWriter.OUTPUT_ROWS, DatasetWriter.OUTPUT_BITMAP]:
+        raise SystemError('{0} is not a dataset of receptions'.format(filename))
+
+    dirname = cache_dirname(filename, cache_dir)
+    source  = reader.source()
+    if not force and os.path.exists(os.path.join(dirname, 'meta.json')):
+        cache = ColumnCache(dirname)
+        if cache.meta.get('version') == CACHE_VERSION and cache.meta.get('source') == source:
+            return cache
+
+    # write to a temporary directory, then swap it in
+    tmpdir = dirname + '.tmp'
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    try:
+        (rows, macs) = _convert(reader, tmpdir)
+        with open(os.path.join(tmpdir, 'meta.json'), 'w') as f:
+            json.dump(
+                {
+                    'version':    CACHE_VERSION,
+                    'dataset':    os.path.basename(filename),
+                    'source':     source,
+                    'settings':   reader.settings,
+                    'rows':       rows,
+                    'macs':       macs,
+                    'byteorder':  sys.byteorder,
+                    'columns':    COLUMNS,
+                },
+                f,
+            )
+    except:
+        shutil.rmtree(tmpdir)
+        raise
+    if os.path.isdir(dirname):
+        shutil.rmtree(dirname)
+    os.rename(tmpdir, dirname)
+    return ColumnCache(dirname)
+
+
+def cache_dirname(filename, cache_dir=None):
+    """
+    :returns: the directory of the column cache of a dataset
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), DatasetReader.CACHE_DIRNAME)
+    name = os.path.basename(filename)
+    for ext in ['.manifest.json', '.csv.gz']:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return os.path.join(cache_dir, '{0}.columns'.format(name))
+
+
+def _packets(reader):
+    # one (timestamp, src, dst, channel, rssi, crc, expected, transctr, pkctr) tuple per packet
+    if reader.output == DatasetWriter.OUTPUT_BITMAP:
+        for row in reader.rows():
+            (timestamp, src, dst, channel, transctr) = row[:5]
+            bitmap = int(row[8], 16)
+            rssis  = binascii.unhexlify(row[9])
+            rssis  = struct.unpack('>{0}b'.format(len(rssis)), rssis)
+            pkctrs = [i for i in range(bitmap.bit_length()) if bitmap >> i & 1]
+            for (pkctr, rssi) in zip(pkctrs, rssis):
+                yield (timestamp, src, dst, channel, rssi, 1, 1, transctr, pkctr)
+    else:
+        for row in reader.rows():
+            yield row[:9]
+
+
+def _convert(reader, dirname):
+    macidx     = {}
+    timestamps = DatasetReader.TimestampParser()
+    buffers    = [array.array(typecode) for (_, typecode) in COLUMNS]
+    files      = [open(os.path.join(dirname, '{0}.bin'.format(name)), 'wb') for (name, _) in COLUMNS]
+    rows       = 0
+    try:
+        for (timestamp, src, dst, channel, rssi, crc, expected, transctr, pkctr) in _packets(reader):
+            for mac in (src, dst):
+                if mac not in macidx:
+                    macidx[mac] = len(macidx)
+            values = (
+                timestamps.parse(timestamp),
+                macidx[src],
+                macidx[dst],
+                int(channel),
+                int(rssi),
+                int(crc),
+                int(expected),
+                int(transctr),
+                int(pkctr),
+            )
+            for (buf, value) in zip(buffers, values):
+                buf.append(value)
+            rows += 1
+            if len(buffers[0]) >= FLUSH_ROWS:
+                buffers = _flush(buffers, files)
+        _flush(buffers, files)
+    finally:
+        for f in files:
+            f.close()
+    macs = sorted(macidx, key=macidx.get)
+    return (rows, macs)
+
+
+def _flush(buffers, files):
+    for (buf, f) in zip(buffers, files):
+        buf.tofile(f)
+    return [array.array(buf.typecode) for buf in buffers]
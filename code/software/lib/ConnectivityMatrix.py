@@ -0,0 +1,165 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+import DatasetReader
+
+CACHE_VERSION = 2   # changes invalidate all cached matrices
+
+
+class ConnectivityMatrix(object):
+    """
+    The connectivity of a dataset, as NumPy tensors indexed by
+    [transaction, src, dst, channel]:
+
+    received:  number of packets received correctly from the expected transmitter
+    rssi_sum:  sum of their RSSI, in dBm
+
+    macs and channels give the node and channel of each index: those of
+    the experiment, as recorded in the settings, and any other heard in the
+    dataset. pdr(),
+    rssi(), and their aggregated variants over all transactions, derive the
+    usual figures from them.
+    """
+
+    def __init__(self, settings, macs, channels, received, rssi_sum):
+
+        self.settings             = settings
+        self.macs                 = macs
+        self.channels             = channels
+        self.received             = received
+        self.rssi_sum             = rssi_sum
+
+    #======================== public ==========================================
+
+    def pdr(self):
+        """
+        :returns: the packet delivery ratio, per [transaction, src, dst, channel]
+        """
+        return self.received/float(self.settings['tx_count'])
+
+    def rssi(self):
+        """
+        :returns: the average RSSI, per [transaction, src, dst, channel], nan without reception
+        """
+        return _mean(self.rssi_sum, self.received)
+
+    def pdr_all(self):
+        """
+        :returns: the packet delivery ratio over all transactions, per [src, dst, channel]
+        """
+        return self.received.sum(axis=0)/float(self.received.shape[0]*self.settings['tx_count'])
+
+    def rssi_all(self):
+        """
+        :returns: the average RSSI over all transactions, per [src, dst, channel]
+        """
+        return _mean(self.rssi_sum.sum(axis=0), self.received.sum(axis=0))
+
+    def save(self, filename):
+        with open(filename + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                settings  = np.array(json.dumps(self.settings)),
+                macs      = np.array(self.macs),
+                channels  = np.array(self.channels),
+                received  = self.received,
+                rssi_sum  = self.rssi_sum,
+            )
+        os.rename(filename + '.tmp', filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(
+                settings  = json.loads(str(data['settings'])),
+                macs      = [str(m) for m in data['macs']],
+                channels  = [int(c) for c in data['channels']],
+                received  = data['received'],
+                rssi_sum  = data['rssi_sum'],
+            )
+
+#============================ helpers =========================================
+
+
+def build(filename, cache_dir=None, use_cache=True):
+    """
+    Build the connectivity matrix of a dataset, or load it from the cache.
+
+    Matrices are cached as .npz files in cache_dir (by default the
+    DatasetReader.CACHE_DIRNAME directory next to the dataset), named after
+    a hash of the settings of the dataset and of the size and modification
+    time of its files, so a dataset which changes is rebuilt.
+
+    :returns: a ConnectivityMatrix
+    """
+
+    reader = DatasetReader.DatasetReader(filename)
+    if reader.settings is None:
+        raise SystemError('{0} has no data'.format(filename))
+
+    if not use_cache:
+        return _build(reader)
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), DatasetReader.CACHE_DIRNAME)
+    cached = os.path.join(cache_dir, '{0}.npz'.format(cache_key(reader)))
+    if os.path.exists(cached):
+        return ConnectivityMatrix.load(cached)
+
+    matrix = _build(reader)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    matrix.save(cached)
+    return matrix
+
+
+def cache_key(reader):
+    """
+    :returns: the name of the cached matrix of a dataset
+    """
+    h = hashlib.sha1()
+    h.update(str(CACHE_VERSION))
+    h.update(json.dumps(reader.settings, sort_keys=True))
+    h.update(json.dumps(reader.source()))
+    return h.hexdigest()
+
+
+def _build(reader):
+
+    # sum the receptions of each link
+    links = {}
+    for (_, src, dst, channel, transctr, rssis) in reader.links():
+        key = (transctr, src, dst, channel)
+        if key not in links:
+            links[key] = [0, 0]
+        links[key][0] += len(rssis)
+        links[key][1] += sum(rssis)
+
+    # index nodes, channels and transactions, silent ones included
+    macs     = sorted(
+        set(reader.settings.get('nodes', [])) |
+        set([k[1] for k in links]) |
+        set([k[2] for k in links])
+    )
+    channels = sorted(set(reader.settings.get('channels', [])) | set([k[3] for k in links]))
+    nbtrans  = max([reader.settings.get('transaction_count', 0)] + [k[0]+1 for k in links])
+    macidx   = dict([(m, i) for (i, m) in enumerate(macs)])
+    chidx    = dict([(c, i) for (i, c) in enumerate(channels)])
+
+    shape    = (nbtrans, len(macs), len(macs), len(channels))
+    received = np.zeros(shape, dtype=np.uint32)
+    rssi_sum = np.zeros(shape, dtype=np.float64)
+    for ((transctr, src, dst, channel), (count, total)) in links.items():
+        index = (transctr, macidx[src], macidx[dst], chidx[channel])
+        received[index] = count
+        rssi_sum[index] = total
+
+    return ConnectivityMatrix(reader.settings, macs, channels, received, rssi_sum)
+
+
+def _mean(total, count):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 0, total/np.maximum(count, 1), np.nan)
@@ -0,0 +1,140 @@
+import os
+
+import DatasetReader
+import DatasetWriter
+import ExternalSort
+
+RUN_ROWS     = ExternalSort.RUN_ROWS   # rows sorted in memory at once
+
+# settings which must be equal in all merged datasets
+CONSISTENT_SETTINGS = ['interframe_duration', 'fill_byte', 'tx_length', 'tx_count', 'txpower', 'location']
+
+# column of the transaction id, per output type
+TRANSACTION_COLUMN = {
+    DatasetWriter.OUTPUT_ROWS:   7,
+    DatasetWriter.OUTPUT_BITMAP: 4,
+}
+
+
+class DatasetMerge(object):
+    """
+    Merges several datasets of the same experiment (e.g. resumed or sharded
+    runs) into one, ordered by transaction, channel, src, dst and pkctr (or
+    reception time for bitmap datasets), in bounded memory.
+
+    The rows are sorted by an ExternalSort, in runs of run_rows rows.
+    Identical rows are written once. With renumber, the transactions of
+    each dataset are numbered after those of the previous ones, e.g. for a
+    run resumed from transaction 0.
+    """
+
+    def __init__(self, inputs, output, renumber=False, run_rows=RUN_ROWS, tmpdir=None, force=False):
+
+        # slot params
+        self.inputs               = inputs
+        self.output               = output
+        self.renumber             = renumber
+        self.run_rows             = run_rows
+        self.tmpdir               = tmpdir
+
+        # local variables
+        self.readers              = [DatasetReader.DatasetReader(f) for f in inputs]
+        self.format               = self._check_inputs(force)
+        self.rows                 = 0
+        self.duplicates           = 0
+        self.runs                 = 0
+        self.transactions         = 0
+        self.macs                 = set()
+
+    #======================== public ==========================================
+
+    def run(self):
+        """
+        :returns: the number of rows written
+        """
+        sorter = ExternalSort.ExternalSort(self._sort_key, self.run_rows, self.tmpdir, unique=True)
+        try:
+            self._write_output(sorter.sort(self._lines()))
+        finally:
+            sorter.close()
+            self.runs       = sorter.runs
+            self.duplicates = sorter.duplicates
+        return self.rows
+
+    def settings(self):
+        """
+        :returns: the settings of the merged dataset
+        """
+        settings  = self.readers[0].settings.copy()
+        unresponsive = set(settings.get('unresponsive_nodes', []))
+        for reader in self.readers[1:]:
+            unresponsive &= set(reader.settings.get('unresponsive_nodes', []))
+        settings.update({
+            'start_date':         min([r.settings['start_date'] for r in self.readers]),
+            'transaction_count':  self.transactions,
+            'node_count':         len(self.macs),
+            'unresponsive_nodes': sorted(unresponsive),
+            'merged_from':        [os.path.basename(f) for f in self.inputs],
+        })
+        return settings
+
+    #======================== private =========================================
+
+    def _check_inputs(self, force):
+        first = self.readers[0]
+        for reader in self.readers:
+            if reader.settings is None:
+                raise SystemError('{0} has no data'.format(reader.filename))
+            if reader.output not in TRANSACTION_COLUMN:
+                raise SystemError('{0} is not a dataset of receptions'.format(reader.filename))
+            if reader.output != first.output:
+                raise SystemError('{0} and {1} have different formats'.format(first.filename, reader.filename))
+            if force:
+                continue
+            for key in CONSISTENT_SETTINGS:
+                if reader.settings.get(key) != first.settings.get(key):
+                    raise SystemError('{0} and {1} have different {2} settings'.format(
+                        first.filename, reader.filename, key,
+                    ))
+        return first.output
+
+    def _sort_key(self, line):
+        fields = line.split(',')
+        if self.format == DatasetWriter.OUTPUT_BITMAP:
+            # transaction, channel, src, dst, timestamp
+            return (int(fields[4]), int(fields[3]), fields[1], fields[2], fields[0])
+        # transaction, channel, src, dst, pkctr
+        return (int(fields[7]), int(fields[3]), fields[1], fields[2], int(fields[8]))
+
+    def _lines(self):
+        column = TRANSACTION_COLUMN[self.format]
+        offset = 0
+        for reader in self.readers:
+            last = -1
+            for line in reader.lines():
+                fields = line.split(',', column+1)
+                transctr = int(fields[column])+offset
+                if self.renumber:
+                    fields[column] = str(transctr)
+                    line = ','.join(fields)
+                last = max(last, transctr)
+                self.macs.add(fields[1])
+                self.macs.add(fields[2])
+                yield line
+            self.transactions = max(self.transactions, last+1)
+            if self.renumber:
+                offset = max(
+                    offset+reader.settings.get('transaction_count', 0),
+                    last+1,
+                )
+
+    def _write_output(self, lines):
+        writer = DatasetWriter.WRITERS[self.format](self.output, self.settings())
+        try:
+            with writer.dataLock:
+                for line in lines:
+                    writer.file.write(line)
+                    writer.rows += 1
+        finally:
+            writer.close()
+        self.rows = writer.rows
@@ -0,0 +1,160 @@
+import os
+import gzip
+import time
+import json
+import binascii
+import struct
+
+import DatasetWriter
+import RssiHistogram
+
+CACHE_DIRNAME = '.mercator_cache'  # directory of the files derived from datasets, next to them
+
+
+class DatasetReader(object):
+    """
+    Reads a Mercator dataset written by DatasetWriter: a single file, with
+    one row per packet or one bitmap per link, or the manifest of a
+    segmented dataset.
+    """
+
+    def __init__(self, filename):
+
+        # slot params
+        self.filename             = filename
+
+        # local variables
+        self.files                = dataset_files(filename)
+        self.settings             = None
+        self.header               = None
+
+        if self.files:
+            f = gzip.open(self.files[0], 'rb')
+            try:
+                self.settings     = json.loads(f.readline())
+                self.header       = f.readline().strip()
+            finally:
+                f.close()
+
+        if   self.header == DatasetWriter.BITMAP_HEADER:
+            self.output           = DatasetWriter.OUTPUT_BITMAP
+        elif self.header == DatasetWriter.BAD_FRAMES_HEADER:
+            self.output           = DatasetWriter.OUTPUT_BAD_FRAMES
+        else:
+            self.output           = DatasetWriter.OUTPUT_ROWS
+
+    #======================== public ==========================================
+
+    def lines(self):
+        """
+        :returns: a generator of the data lines of all files, without the
+                  settings and CSV header
+        """
+        for filename in self.files:
+            f = gzip.open(filename, 'rb')
+            try:
+                f.readline()
+                f.readline()
+                for line in f:
+                    yield line
+            finally:
+                f.close()
+
+    def rows(self):
+        """
+        :returns: a generator of the data rows, split in fields
+        """
+        for line in self.lines():
+            yield line.rstrip('\n').split(',')
+
+    def links(self):
+        """
+        Read the packets received correctly from the expected transmitter.
+
+        :returns: a generator of (timestamp, src, dst, channel, transctr,
+                  rssis) tuples: one per packet for a dataset with one row
+                  per packet, one per link and step for a bitmap dataset.
+                  MAC addresses are strings, as in the dataset.
+        """
+        if self.output == DatasetWriter.OUTPUT_BITMAP:
+            for row in self.rows():
+                (timestamp, src, dst, channel, transctr, received) = row[:6]
+                rssi = binascii.unhexlify(row[9])
+                yield (timestamp, src, dst, int(channel), int(transctr),
+                       list(struct.unpack('>{0}b'.format(len(rssi)), rssi)))
+        elif self.output == DatasetWriter.OUTPUT_ROWS:
+            for row in self.rows():
+                (timestamp, src, dst, channel, rssi, crc, expected, transctr) = row[:8]
+                if crc == '1' and expected == '1':
+                    yield (timestamp, src, dst, int(channel), int(transctr), [int(rssi)])
+
+    def scheduled_links(self):
+        """
+        :returns: the (src, dst, channel) links measured by the experiment,
+                  each node transmitting to all others on every channel;
+                  empty for a dataset written without its nodes and channels
+        """
+        nodes    = self.settings.get('nodes', [])
+        channels = self.settings.get('channels', [])
+        return [(src, dst, channel) for src in nodes for dst in nodes if src != dst for channel in channels]
+
+    def rssi_histograms(self):
+        """
+        :returns: the RssiHistogram of each (src, dst, channel) link, over all
+                  transactions; MAC addresses are strings
+        """
+        returnval = {}
+        for (_, src, dst, channel, _, rssis) in self.links():
+            key = (src, dst, channel)
+            if key not in returnval:
+                returnval[key] = RssiHistogram.RssiHistogram()
+            h = returnval[key]
+            for rssi in rssis:
+                h.add(rssi)
+        return returnval
+
+    def source(self):
+        """
+        :returns: the name, size and modification time of each file of the
+                  dataset, which identify its content without reading it
+        """
+        returnval = []
+        for f in self.files:
+            st = os.stat(f)
+            returnval += [[os.path.basename(f), st.st_size, st.st_mtime]]
+        return returnval
+
+
+class TimestampParser(object):
+    """
+    Converts dataset timestamps to seconds since the epoch, fast: the
+    timestamps of consecutive rows mostly share their second, which is only
+    parsed once.
+    """
+
+    def __init__(self):
+        self.lastSecond           = None
+        self.lastEpoch            = None
+
+    def parse(self, timestamp):
+        second = timestamp[:19]
+        if second != self.lastSecond:
+            self.lastSecond = second
+            self.lastEpoch  = time.mktime(time.strptime(second, DatasetWriter.TIMESTAMP_FORMAT[:-3]))
+        return self.lastEpoch+float('0'+timestamp[19:])
+
+#============================ helpers =========================================
+
+
+def dataset_files(filename):
+    """
+    :returns: the files of a dataset, in order: its segments for a manifest,
+              else the file itself
+    """
+    if not filename.endswith('.manifest.json'):
+        return [filename]
+    with open(filename) as f:
+        manifest = json.load(f)
+    directory = os.path.dirname(filename)
+    return [os.path.join(directory, s['filename']) for s in manifest['segments'] if s['compressed']]
+
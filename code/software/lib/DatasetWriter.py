@@ -0,0 +1,534 @@
+import os
+import gzip
+import time
+import heapq
+import itertools
+import json
+import shutil
+import struct
+import binascii
+import datetime
+import threading
+import multiprocessing.pool
+
+import ExternalSort
+import RssiHistogram
+import MercatorDefines as d
+
+CSV_HEADER = 'datetime,src,dst,channel,rssi,crc,expected,transaction_id,pkctr'
+BITMAP_HEADER = 'datetime,src,dst,channel,transaction_id,received,crc_errors,unexpected,bitmap,rssi'
+LINK_HEADER = 'datetime,src,dst,channel,transaction_id,crc_errors,unexpected'
+BAD_FRAMES_HEADER = 'datetime,src,dst,channel,transaction_id,crc_errors,unexpected,rssi_histogram'
+RSSI_HEADER = 'src,dst,channel,received,rssi_mean,rssi_p10,rssi_p50,rssi_p90,rssi_histogram'
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H:%M:%S.%f"
+
+OUTPUT_ROWS   = 'rows'
+OUTPUT_BITMAP = 'bitmap'
+OUTPUT_BAD_FRAMES = 'bad_frames'
+
+BAD_FRAMES_ROWS  = 'rows'   # frames with a wrong CRC or from another transmitter are written like the others
+BAD_FRAMES_COUNT = 'count'  # they are counted per link and step, in a separate file
+
+COMPRESS_THREADS = 4        # number of segments compressed concurrently
+
+
+class DatasetWriter(object):
+    """
+    Writes a raw Mercator dataset: one JSON settings line, a CSV header and
+    one row per received packet, gzip-compressed.
+
+    With bad_frames=BAD_FRAMES_COUNT, frames received with a wrong CRC or
+    from another transmitter are not written to the dataset but counted in
+    a BadFramesWriter, next to it (see bad_frames_filename()).
+
+    With segment_rows or segment_minutes, the dataset is written as a
+    series of segments, see SegmentedFile.
+
+    Rows can be written from several MoteHandler threads at once.
+    """
+
+    HEADER = CSV_HEADER
+
+    def __init__(self, filename, settings=None, bad_frames=BAD_FRAMES_ROWS, segment_rows=0, segment_minutes=0):
+
+        self.filename             = filename
+        self.dataLock             = threading.Lock()
+        self.rows                 = 0
+        self.badFrames            = None
+
+        if segment_rows or segment_minutes:
+            self.file             = SegmentedFile(filename, segment_rows, segment_minutes)
+        else:
+            self.file             = gzip.open(filename, 'wb')
+
+        if bad_frames == BAD_FRAMES_COUNT:
+            self.badFrames        = BadFramesWriter(bad_frames_filename(filename), settings)
+
+        if settings is not None:
+            self.write_settings(settings)
+
+    #======================== public ==========================================
+
+    def write_settings(self, settings):
+        header = json.dumps(settings) + '\n' + self.HEADER + '\n'
+        with self.dataLock:
+            if isinstance(self.file, SegmentedFile):
+                self.file.write_header(header, settings)
+            else:
+                self.file.write(header)
+
+    def write_rx(self, src, dst, channel, rssi, crc, expected, transctr, pkctr):
+        if self.badFrames is not None and (crc == 0 or expected == 0):
+            self.badFrames.write_rx(src, dst, channel, rssi, crc, expected, transctr, pkctr)
+            return
+        with self.dataLock:
+            # stamped under the lock, so rows are written in time order
+            self.file.write("{0},{1},{2},{3},{4},{5},{6},{7},{8}\n".format(
+                datetime.datetime.now().strftime(TIMESTAMP_FORMAT),
+                d.format_mac(src),
+                d.format_mac(dst),
+                channel,
+                rssi,
+                crc,
+                expected,
+                transctr,
+                pkctr,
+            ))
+            self.rows += 1
+
+    def end_link(self, src, dst, channel, transctr):
+        # every packet is written as it arrives
+        if self.badFrames is not None:
+            self.badFrames.end_link(src, dst, channel, transctr)
+
+    def close(self):
+        # the bad frames are kept even if the dataset cannot be closed
+        try:
+            with self.dataLock:
+                self.file.close()
+        finally:
+            if self.badFrames is not None:
+                self.badFrames.close()
+
+
+class LinkDatasetWriter(DatasetWriter):
+    """
+    Writes a Mercator dataset with one row per link (transmitter, receiver,
+    channel, transaction), holding the number of frames received with a
+    wrong CRC or from another transmitter. Subclasses keep more about the
+    frames of a link, extending _new_link(), _add_frame() and
+    _format_link().
+
+    A link ends when end_link() is called for it, or when the dataset is
+    closed. Frames received for a link already ended start a new row for
+    it; readers combine such rows. The timestamp of a row is the reception
+    time of its first frame, so rows are written in time order: a link
+    which ends is held back until the links opened before it have ended.
+    """
+
+    HEADER = LINK_HEADER
+
+    def __init__(self, filename, settings=None, bad_frames=BAD_FRAMES_ROWS, segment_rows=0, segment_minutes=0):
+
+        # local variables
+        self.links                = {}
+        self.ended                = []   # heap of (timestamp, line) of the links held back
+
+        DatasetWriter.__init__(self, filename, settings, bad_frames, segment_rows, segment_minutes)
+
+    #======================== public ==========================================
+
+    def write_rx(self, src, dst, channel, rssi, crc, expected, transctr, pkctr):
+        key = (src, dst, channel, transctr)
+        with self.dataLock:
+            if key not in self.links:
+                self.links[key] = self._new_link()
+            self._add_frame(self.links[key], rssi, crc, expected, pkctr)
+
+    def end_link(self, src, dst, channel, transctr):
+        key = (src, dst, channel, transctr)
+        with self.dataLock:
+            link = self.links.pop(key, None)
+            if link is not None:
+                self._end_link(key, link)
+                self._write_ended()
+        DatasetWriter.end_link(self, src, dst, channel, transctr)
+
+    def close(self):
+        try:
+            with self.dataLock:
+                for (key, link) in self.links.items():
+                    self._end_link(key, link)
+                self.links = {}
+                self._write_ended()
+        finally:
+            DatasetWriter.close(self)
+
+    #======================== private =========================================
+
+    def _new_link(self):
+        return {
+            'timestamp':          datetime.datetime.now(),
+            'crc_errors':         0,
+            'unexpected':         0,
+        }
+
+    def _add_frame(self, link, rssi, crc, expected, pkctr):
+        """
+        :returns: whether the frame was received correctly from the expected transmitter
+        """
+        if   crc == 0:
+            link['crc_errors']   += 1
+        elif expected == 0:
+            link['unexpected']   += 1
+        else:
+            return True
+        return False
+
+    def _format_link(self, link):
+        return "{0},{1}".format(
+            link['crc_errors'],
+            link['unexpected'],
+        )
+
+    def _end_link(self, key, link):
+        (src, dst, channel, transctr) = key
+        heapq.heappush(self.ended, (link['timestamp'], "{0},{1},{2},{3},{4},{5}\n".format(
+            link['timestamp'].strftime(TIMESTAMP_FORMAT),
+            d.format_mac(src),
+            d.format_mac(dst),
+            channel,
+            transctr,
+            self._format_link(link),
+        )))
+
+    def _write_ended(self):
+        # write the ended links older than every open link
+        if self.links:
+            oldest = min([link['timestamp'] for link in self.links.itervalues()])
+        else:
+            oldest = None
+        while self.ended and (oldest is None or self.ended[0][0] <= oldest):
+            (_, line) = heapq.heappop(self.ended)
+            self.file.write(line)
+            self.rows += 1
+
+
+class BitmapDatasetWriter(LinkDatasetWriter):
+    """
+    Writes a Mercator dataset with one row per link and transmitter step
+    instead of one row per received packet.
+
+    A row holds the number of packets received with a correct CRC from the
+    expected transmitter, a hex bitmap of their pkctr (bit n set if packet n
+    was received), their RSSI as hex signed bytes in pkctr order, and the
+    number of frames received with a wrong CRC or from another transmitter.
+    With bad_frames=BAD_FRAMES_COUNT, the RSSI of the latter is also
+    counted in a BadFramesWriter.
+    """
+
+    HEADER = BITMAP_HEADER
+
+    def write_rx(self, src, dst, channel, rssi, crc, expected, transctr, pkctr):
+        if self.badFrames is not None and (crc == 0 or expected == 0):
+            self.badFrames.write_rx(src, dst, channel, rssi, crc, expected, transctr, pkctr)
+        LinkDatasetWriter.write_rx(self, src, dst, channel, rssi, crc, expected, transctr, pkctr)
+
+    #======================== private =========================================
+
+    def _new_link(self):
+        link                      = LinkDatasetWriter._new_link(self)
+        link['bitmap']            = 0
+        link['rssi']              = {}
+        return link
+
+    def _add_frame(self, link, rssi, crc, expected, pkctr):
+        if LinkDatasetWriter._add_frame(self, link, rssi, crc, expected, pkctr) and \
+                not link['bitmap'] & (1 << pkctr):
+            link['bitmap']       |= 1 << pkctr
+            link['rssi'][pkctr]   = rssi
+
+    def _format_link(self, link):
+        rssi = [link['rssi'][pkctr] for pkctr in sorted(link['rssi'])]
+        return "{0},{1},{2:x},{3}".format(
+            len(rssi),
+            LinkDatasetWriter._format_link(self, link),
+            link['bitmap'],
+            binascii.hexlify(struct.pack('>{0}b'.format(len(rssi)), *rssi)),
+        )
+
+
+class BadFramesWriter(LinkDatasetWriter):
+    """
+    Counts the frames received with a wrong CRC or from another transmitter,
+    per link and transmitter step, with a histogram of their RSSI.
+
+    The histogram is written as space-separated rssi:count pairs, in
+    increasing RSSI order (see RssiHistogram.format()).
+    """
+
+    HEADER = BAD_FRAMES_HEADER
+
+    #======================== private =========================================
+
+    def _new_link(self):
+        link                      = LinkDatasetWriter._new_link(self)
+        link['histogram']         = RssiHistogram.RssiHistogram()
+        return link
+
+    def _add_frame(self, link, rssi, crc, expected, pkctr):
+        if not LinkDatasetWriter._add_frame(self, link, rssi, crc, expected, pkctr):
+            link['histogram'].add(rssi)
+
+    def _format_link(self, link):
+        return "{0},{1}".format(
+            LinkDatasetWriter._format_link(self, link),
+            link['histogram'].format(),
+        )
+
+WRITERS = {
+    OUTPUT_ROWS:       DatasetWriter,
+    OUTPUT_BITMAP:     BitmapDatasetWriter,
+    OUTPUT_BAD_FRAMES: BadFramesWriter,
+}
+
+
+class SegmentedFile(object):
+    """
+    Writes a dataset as a series of segments instead of a single file.
+
+    A new segment is started every segment_rows rows or segment_minutes
+    minutes, whichever comes first. Each segment is a complete dataset,
+    starting with the settings and CSV header. The segment being written is
+    plain text, line-buffered, so a crash of the program only loses the row
+    being written; closed segments are gzip-compressed by a pool of threads
+    while the next one is written. close() raises SystemError if a segment
+    could not be compressed; it is left uncompressed in the manifest.
+
+    The manifest (see manifest_filename()) lists the settings and the
+    segments, with their number of rows and the timestamps of their first
+    and last rows. It is rewritten each time a segment is closed or
+    compressed, and marked complete when the dataset is closed.
+    """
+
+    def __init__(self, filename, segment_rows=0, segment_minutes=0):
+
+        # slot params
+        self.filename             = filename
+        self.segment_rows         = segment_rows
+        self.segment_minutes      = segment_minutes
+
+        # local variables
+        self.manifestLock         = threading.Lock()
+        self.pool                 = multiprocessing.pool.ThreadPool(COMPRESS_THREADS)
+        self.header               = ''
+        self.settings             = None
+        self.segments             = []
+        self.compressions         = []
+        self.current              = None
+        self.currentStart         = None
+        self.complete             = False
+
+    #======================== public ==========================================
+
+    def write_header(self, header, settings):
+        self.header               = header
+        self.settings             = settings
+
+    def write(self, line):
+        if self.current is None:
+            self._open_segment()
+        elif self._segment_full():
+            self._close_segment()
+            self._open_segment()
+        self.current.write(line)
+        segment                   = self.segments[-1]
+        segment['rows']          += 1
+        segment['last']           = line.split(',', 1)[0]
+        if segment['first'] is None:
+            segment['first']      = segment['last']
+
+    def close(self):
+        if self.current is not None:
+            self._close_segment()
+        self.pool.close()
+        self.pool.join()
+        with self.manifestLock:
+            self.complete         = True
+            self._write_manifest()
+
+        failed = []
+        for (segment, result) in self.compressions:
+            try:
+                result.get()
+            except Exception as err:
+                failed += ['{0} ({1})'.format(segment['filename'], err)]
+        if failed:
+            raise SystemError('could not compress the segments {0}'.format(', '.join(failed)))
+
+    #======================== private =========================================
+
+    def _segment_full(self):
+        if self.segment_rows and self.segments[-1]['rows'] >= self.segment_rows:
+            return True
+        if self.segment_minutes and time.time()-self.currentStart >= 60*self.segment_minutes:
+            return True
+        return False
+
+    def _open_segment(self):
+        filename                  = segment_filename(self.filename, len(self.segments))
+        self.current              = open(filename[:-len('.gz')], 'wb', 1)
+        self.currentStart         = time.time()
+        self.current.write(self.header)
+        with self.manifestLock:
+            self.segments        += [{
+                'filename':       os.path.basename(filename),
+                'rows':           0,
+                'first':          None,
+                'last':           None,
+                'compressed':     False,
+            }]
+
+    def _close_segment(self):
+        self.current.close()
+        self.current              = None
+        segment                   = self.segments[-1]
+        with self.manifestLock:
+            self._write_manifest()
+        result                    = self.pool.apply_async(
+            _compress_segment,
+            (os.path.join(os.path.dirname(self.filename), segment['filename']),),
+            callback              = lambda _: self._segment_compressed(segment),
+        )
+        self.compressions        += [(segment, result)]
+
+    def _segment_compressed(self, segment):
+        with self.manifestLock:
+            segment['compressed'] = True
+            self._write_manifest()
+
+    def _write_manifest(self):
+        filename = manifest_filename(self.filename)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump({
+                'settings':       self.settings,
+                'segments':       self.segments,
+                'complete':       self.complete,
+            }, f, indent=4, sort_keys=True)
+        os.rename(filename + '.tmp', filename)
+
+#============================ helpers =========================================
+
+
+def merge_parts(filename, settings, parts, output=OUTPUT_ROWS, **kwargs):
+    """
+    Merge datasets written without a settings header (e.g. by several
+    shards) into a single dataset of the given output type. Extra keyword
+    arguments are passed on to the writer.
+
+    Rows start with their timestamp. Parts with one row per packet are
+    ordered by time, so they are merged on it without loading them into
+    memory. The rows of the other outputs are ordered by time within a
+    part, but a row can be written after a later row of another part was
+    merged, so their parts are sorted in bounded memory, see ExternalSort.
+
+    :returns: the number of rows in the merged dataset
+    """
+
+    inputs = [gzip.open(p, 'rb') for p in parts]
+    sorter = ExternalSort.ExternalSort(tmpdir=os.path.dirname(os.path.abspath(filename)))
+    writer = WRITERS[output](filename, settings, **kwargs)
+    try:
+        if output == OUTPUT_ROWS:
+            lines = heapq.merge(*inputs)
+        else:
+            lines = sorter.sort(itertools.chain(*inputs))
+        with writer.dataLock:
+            for line in lines:
+                writer.file.write(line)
+                writer.rows += 1
+    finally:
+        writer.close()
+        sorter.close()
+        for f in inputs:
+            f.close()
+
+    return writer.rows
+
+
+def write_rssi_histograms(filename, settings, histograms):
+    """
+    Write the RSSI histogram of each link of a dataset, with its mean and
+    quantiles.
+
+    :param dict histograms: the RssiHistogram of each (src, dst, channel)
+    """
+    f = gzip.open(filename, 'wb')
+    try:
+        json.dump(settings, f)
+        f.write('\n' + RSSI_HEADER + '\n')
+        for ((src, dst, channel), h) in sorted(histograms.items()):
+            f.write('{0},{1},{2},{3},{4:.2f},{5},{6},{7},{8}\n'.format(
+                d.format_mac(src),
+                d.format_mac(dst),
+                channel,
+                h.count(),
+                h.mean(),
+                h.quantile(0.1),
+                h.quantile(0.5),
+                h.quantile(0.9),
+                h.format(),
+            ))
+    finally:
+        f.close()
+
+
+def rssi_filename(filename):
+    """
+    :returns: the name of the file the RSSI histograms of a dataset are written to
+    """
+    if filename.endswith('.csv.gz'):
+        return filename[:-len('.csv.gz')]+'_rssi.csv.gz'
+    return filename+'.rssi'
+
+
+def bad_frames_filename(filename):
+    """
+    :returns: the name of the file the bad frames of a dataset are counted in
+    """
+    if filename.endswith('.csv.gz'):
+        return filename[:-len('.csv.gz')]+'_badframes.csv.gz'
+    return filename+'.badframes'
+
+
+def segment_filename(filename, index):
+    """
+    :returns: the name of a segment of a dataset
+    """
+    if filename.endswith('.csv.gz'):
+        return '{0}.{1:04d}.csv.gz'.format(filename[:-len('.csv.gz')], index)
+    return '{0}.{1:04d}.gz'.format(filename, index)
+
+
+def manifest_filename(filename):
+    """
+    :returns: the name of the manifest of a segmented dataset
+    """
+    if filename.endswith('.csv.gz'):
+        return filename[:-len('.csv.gz')]+'.manifest.json'
+    return filename+'.manifest.json'
+
+
+def _compress_segment(filename):
+    """
+    Compress the plain text segment written for a segment filename, then
+    remove it.
+    """
+    plain = filename[:-len('.gz')]
+    with open(plain, 'rb') as fin:
+        fout = gzip.open(filename, 'wb')
+        try:
+            shutil.copyfileobj(fin, fout, 1 << 20)
+        finally:
+            fout.close()
+    os.remove(plain)
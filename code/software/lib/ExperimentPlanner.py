@@ -0,0 +1,177 @@
+import os
+import json
+import math
+
+import MoteGroup
+
+ASSUMED_RTT        = 0.05   # REQ_ST round-trip time when none was measured yet, in s
+ASSUMED_SEND_TIME  = 0.001  # time to send a command to a mote, in s
+ASSUMED_CONNECT    = 10     # time to connect to all motes, in s
+DURATION_MARGIN    = 1.2    # safety factor applied to the recommended duration
+CALIBRATION_WEIGHT = 0.5    # weight of the last run when updating the calibration
+
+PHASE_CONNECT      = 'connect'
+PHASE_PREPARE      = 'prepare'
+PHASE_TX           = 'tx'
+PHASE_VERIFY       = 'verify'
+PHASE_ALL = [
+    PHASE_CONNECT,
+    PHASE_PREPARE,
+    PHASE_TX,
+    PHASE_VERIFY,
+]
+
+SCHEDULE_SEQUENTIAL = 'sequential'   # each phase over all motes, one mote after the other
+SCHEDULE_PIPELINED  = 'pipelined'    # each mote verified and prepared as soon as possible, concurrently
+SCHEDULE_ALL = [
+    SCHEDULE_SEQUENTIAL,
+    SCHEDULE_PIPELINED,
+]
+
+
+class ExperimentPlanner(object):
+    """
+    Estimates how long an experiment takes, per phase.
+
+    connect:  connecting to all motes
+    prepare:  switching all motes to idle then RX for a transmitter, with the state checks
+    tx:       the transmitter sending its packets
+    verify:   the state checks after the transmission
+
+    The model counts round trips and commands per transmitter step, for the
+    given schedule. After each run, the ratio between actual and planned
+    time of each phase, and the measured round-trip time, are saved to a
+    calibration file and used by the next plans. The ratios are kept per
+    kind of run: schedule, optimistic or not, sharded or not.
+    """
+
+    def __init__(self, calibration_file=None):
+
+        # slot params
+        self.calibration_file     = calibration_file
+
+        # local variables
+        self.calibration          = {
+            'rtt':                ASSUMED_RTT,
+            'factors':            {},
+        }
+
+        # a calibration file which cannot be read is replaced by the next calibration
+        if calibration_file and os.path.exists(calibration_file):
+            with open(calibration_file) as f:
+                try:
+                    self.calibration.update(json.load(f))
+                except ValueError:
+                    pass
+
+    #======================== public ==========================================
+
+    def plan(self, nbnodes, nbtrans, nbpackets, nbfrequencies, txifdur,
+             schedule, optimistic=0, shards=1, connect=True):
+        """
+        :returns: the planned duration of each phase, in s
+        """
+
+        rtt       = self.calibration['rtt']
+        send      = ASSUMED_SEND_TIME
+
+        # motes handled one after the other, the shards working in parallel
+        nbserial  = int(math.ceil(nbnodes/float(max(shards, 1))))
+
+        # one transmitter step with all checks
+        if schedule == SCHEDULE_PIPELINED:
+            waves   = int(math.ceil(nbserial/float(MoteGroup.PIPELINE_THREADS)))
+            prepare = waves*(3*rtt+2*send)
+            verify  = 0
+        else:
+            prepare = nbserial*(2*send+2*rtt)
+            verify  = nbserial*rtt
+
+        # optimistic steps only send REQ_RX
+        if optimistic > 1:
+            full    = 1.0/optimistic
+            prepare = full*prepare+(1-full)*nbserial*send
+            verify  = full*verify
+
+        steps     = nbtrans*nbfrequencies*nbnodes
+        returnval = {
+            PHASE_CONNECT:        ASSUMED_CONNECT if connect else 0,
+            PHASE_PREPARE:        steps*prepare,
+            PHASE_TX:             steps*(nbpackets*txifdur/1000.0+rtt),
+            PHASE_VERIFY:         steps*verify,
+        }
+
+        factors   = self.calibration['factors'].get(_factors_key(schedule, optimistic, shards), {})
+        for phase in returnval:
+            returnval[phase] *= factors.get(phase, 1.0)
+
+        return returnval
+
+    @staticmethod
+    def recommend_duration(plans):
+        """
+        :returns: the duration to reserve for the given plans, in minutes
+        """
+        total = sum([sum(p.values()) for p in plans])
+        return int(math.ceil(total*DURATION_MARGIN/60.0))+1
+
+    @staticmethod
+    def format(plan, actual=None):
+        output  = []
+        if actual is None:
+            output += ['{0:<10} {1:>10}'.format('phase', 'planned')]
+        else:
+            output += ['{0:<10} {1:>10} {2:>10}'.format('phase', 'planned', 'actual')]
+        for phase in PHASE_ALL + ['total']:
+            if phase == 'total':
+                planned  = sum(plan.values())
+                measured = sum(actual.values()) if actual is not None else None
+            else:
+                planned  = plan[phase]
+                measured = actual.get(phase, 0) if actual is not None else None
+            if actual is None:
+                output += ['{0:<10} {1:>9.1f}s'.format(phase, planned)]
+            else:
+                output += ['{0:<10} {1:>9.1f}s {2:>9.1f}s'.format(phase, planned, measured)]
+        return output
+
+    def calibrate(self, actual, rtt=None, **params):
+        """
+        Correct the model with the actual duration of each phase of a run.
+
+        :param dict actual: the measured duration of each phase, in s
+        :param float rtt: the round-trip time measured during the run, in s
+        :param params: the parameters of the run, as passed to plan()
+        """
+
+        # replan with the measured round-trip time, then correct what remains
+        if rtt:
+            self.calibration['rtt'] = rtt
+        plan    = self.plan(**params)
+        factors = self.calibration['factors'].setdefault(
+            _factors_key(params['schedule'], params.get('optimistic', 0), params.get('shards', 1)),
+            {},
+        )
+        for phase in PHASE_ALL:
+            if plan.get(phase) and actual.get(phase):
+                old            = factors.get(phase, 1.0)
+                measured       = old*actual[phase]/plan[phase]
+                factors[phase] = (1-CALIBRATION_WEIGHT)*old+CALIBRATION_WEIGHT*measured
+
+        # replaced at once, as other processes (e.g. other sites) may be reading it
+        if self.calibration_file:
+            tmpfile = '{0}.{1}.tmp'.format(self.calibration_file, os.getpid())
+            with open(tmpfile, 'w') as f:
+                json.dump(self.calibration, f, indent=4, sort_keys=True)
+            os.rename(tmpfile, self.calibration_file)
+
+#============================ helpers =========================================
+
+
+def _factors_key(schedule, optimistic, shards):
+    # runs which spend their time differently are calibrated separately
+    return '{0}/{1}/{2}'.format(
+        schedule,
+        'optimistic' if optimistic > 1 else 'checked',
+        'sharded' if shards > 1 else 'single',
+    )
@@ -0,0 +1,116 @@
+import os
+import gzip
+import heapq
+import shutil
+import tempfile
+
+RUN_ROWS     = 1000000   # rows sorted in memory at once
+MERGE_FANIN  = 64        # runs merged at once
+RUN_GZ_LEVEL = 1         # compression of the temporary runs
+
+
+class ExternalSort(object):
+    """
+    Sorts lines in bounded memory.
+
+    The lines are sorted in runs of run_rows lines, written to temporary
+    files in tmpdir, then merged MERGE_FANIN runs at a time. Lines are
+    compared on key(line), or on themselves without a key. With unique,
+    identical lines are returned once.
+
+    sort() reads all the lines before it returns; close() removes the
+    temporary files.
+    """
+
+    def __init__(self, key=None, run_rows=RUN_ROWS, tmpdir=None, unique=False):
+
+        # slot params
+        self.key                  = key
+        self.run_rows             = run_rows
+        self.tmpdir               = tmpdir
+        self.unique               = unique
+
+        # local variables
+        self.workdir              = None
+        self.runs                 = 0
+        self.duplicates           = 0
+
+    #======================== public ==========================================
+
+    def sort(self, lines):
+        """
+        :returns: a generator of the sorted lines
+        """
+        self.workdir = tempfile.mkdtemp(prefix='mercator-sort-', dir=self.tmpdir)
+        runs = self._write_runs(lines)
+        while len(runs) > MERGE_FANIN:
+            runs = [
+                self._merge_runs(runs[i:i+MERGE_FANIN])
+                for i in range(0, len(runs), MERGE_FANIN)
+            ]
+        return self._merged(runs)
+
+    def close(self):
+        if self.workdir is not None:
+            shutil.rmtree(self.workdir)
+            self.workdir = None
+
+    #======================== private =========================================
+
+    def _sort_key(self, line):
+        if self.key is None:
+            return line
+        return (self.key(line), line)
+
+    def _write_runs(self, lines):
+        runs  = []
+        batch = []
+        for line in lines:
+            batch += [line]
+            if len(batch) >= self.run_rows:
+                runs  += [self._write_run(batch)]
+                batch  = []
+        if batch:
+            runs += [self._write_run(batch)]
+        return runs
+
+    def _run_filename(self):
+        filename = os.path.join(self.workdir, 'run{0}.gz'.format(self.runs))
+        self.runs += 1
+        return filename
+
+    def _write_run(self, lines):
+        lines.sort(key=self._sort_key)
+        filename = self._run_filename()
+        f = gzip.open(filename, 'wb', RUN_GZ_LEVEL)
+        try:
+            f.writelines(lines)
+        finally:
+            f.close()
+        return filename
+
+    def _merged(self, runs):
+        files = [gzip.open(r, 'rb') for r in runs]
+        try:
+            last = None
+            for (_, line) in heapq.merge(*[((self._sort_key(l), l) for l in f) for f in files]):
+                if self.unique and line == last:
+                    self.duplicates += 1
+                    continue
+                last = line
+                yield line
+        finally:
+            for f in files:
+                f.close()
+
+    def _merge_runs(self, runs):
+        filename = self._run_filename()
+        f = gzip.open(filename, 'wb', RUN_GZ_LEVEL)
+        try:
+            for line in self._merged(runs):
+                f.write(line)
+        finally:
+            f.close()
+        for r in runs:
+            os.remove(r)
+        return filename
@@ -0,0 +1,179 @@
+import math
+
+import DatasetReader
+import RssiHistogram
+
+BY_TRANSACTION = 'transaction'
+BY_TIME        = 'time'
+
+PERCENTILES    = [10, 50, 90]
+
+
+class LinkWindows(object):
+    """
+    Computes link statistics over tumbling or sliding windows, reading the
+    receptions of a dataset once, in order.
+
+    Windows are size long and start every slide (slide=size gives tumbling
+    windows), counted in transactions or in seconds of wall clock time.
+    Receptions are summed per slide-long pane, and only the panes of the
+    current window are kept, so memory grows with the number of links, not
+    with the number of receptions.
+
+    RSSI statistics are computed from an RssiHistogram per link and pane,
+    merged over the panes of each window.
+
+    Links are reported from the first window, received or not: those of
+    links (the links of the schedule, see DatasetReader.scheduled_links()),
+    and the others as soon as they are heard. The first windows of a
+    sliding series start with the first pane, so they are shorter.
+
+    The number of packets sent on a link during a window is tx_count times
+    its number of steps during the window. Each transaction has one step
+    per link, so for windows counted in transactions it is the number of
+    transactions of the window, up to transaction_count. For windows in
+    seconds, the steps are only known from the receptions: they are the
+    steps of the transmitter on the channel heard by any receiver, and a
+    step nobody heard is not counted. Receptions older than the current
+    window are counted in late and ignored.
+    """
+
+    def __init__(self, size, slide=None, by=BY_TRANSACTION, tx_count=1, transaction_count=None, links=()):
+
+        if slide is None:
+            slide = size
+        npanes = size/float(slide)
+        if slide <= 0 or npanes < 1 or abs(npanes-round(npanes)) > 1e-9:
+            raise SystemError('the window size must be a multiple of the slide')
+
+        # slot params
+        self.size                 = size
+        self.slide                = slide
+        self.by                   = by
+        self.tx_count             = tx_count
+        self.transaction_count    = transaction_count
+
+        # local variables
+        self.npanes               = int(round(npanes))
+        self.panes                = {}
+        self.current              = None
+        self.first                = None
+        self.links                = set(links)
+        self.late                 = 0
+        self.timestamps           = DatasetReader.TimestampParser()
+
+    #======================== public ==========================================
+
+    def add(self, timestamp, src, dst, channel, transctr, rssis):
+        """
+        Add the receptions of a link, as returned by DatasetReader.links().
+
+        :returns: the statistics of the windows which ended before these
+                  receptions, see window()
+        """
+
+        if self.by == BY_TIME:
+            pane = int(math.floor(self.timestamps.parse(timestamp)/self.slide))
+        else:
+            pane = int(math.floor(transctr/float(self.slide)))
+
+        returnval = []
+        if self.first is None:
+            # transactions are counted from 0, time from the first reception
+            self.first   = 0 if self.by == BY_TRANSACTION else pane
+        if self.current is None:
+            self.current = pane
+        elif pane < self.current-self.npanes+1:
+            self.late += 1
+            return returnval
+        while pane > self.current:
+            returnval    += self._close_pane()
+            # skip stretches without any reception
+            if not self.panes:
+                self.current = pane
+
+        if pane not in self.panes:
+            self.panes[pane] = {'links': {}, 'steps': {}}
+        links = self.panes[pane]['links']
+        steps = self.panes[pane]['steps']
+        key   = (src, dst, channel)
+        if key not in links:
+            links[key] = RssiHistogram.RssiHistogram()
+            self.links.add(key)
+        for rssi in rssis:
+            links[key].add(rssi)
+        steps.setdefault((src, channel), set()).add(transctr)
+
+        return returnval
+
+    def flush(self):
+        """
+        :returns: the statistics of the last window
+        """
+        if self.current is None:
+            return []
+        returnval    = self.window(self.current)
+        self.panes   = {}
+        self.current = None
+        return returnval
+
+    def window(self, last_pane):
+        """
+        :returns: the statistics of the window ending with a pane, as a list
+                  of dictionaries with start, end, src, dst, channel, sent,
+                  received, pdr, rssi_mean, rssi_std, and rssi_pN for N in
+                  PERCENTILES
+        """
+        first = max(last_pane-self.npanes+1, self.first)
+        panes = [self.panes[p] for p in range(first, last_pane+1) if p in self.panes]
+        steps = {}
+        links = {}
+        for pane in panes:
+            for (key, transctrs) in pane['steps'].items():
+                steps.setdefault(key, set()).update(transctrs)
+            for (key, h) in pane['links'].items():
+                links.setdefault(key, RssiHistogram.RssiHistogram()).merge(h)
+
+        start     = first*self.slide
+        end       = (last_pane+1)*self.slide
+        returnval = []
+        for key in sorted(self.links):
+            (src, dst, channel) = key
+            sent      = self.tx_count*self._steps(steps, src, channel, start, end)
+            if not sent:
+                continue
+            h         = links.get(key, RssiHistogram.RssiHistogram())
+            stats     = {
+                'start':          start,
+                'end':            end,
+                'src':            src,
+                'dst':            dst,
+                'channel':        channel,
+                'sent':           sent,
+                'received':       h.count(),
+                'pdr':            h.count()/float(sent),
+                'rssi_mean':      h.mean(),
+                'rssi_std':       h.std(),
+            }
+            for p in PERCENTILES:
+                stats['rssi_p{0}'.format(p)] = h.quantile(p/100.0)
+            returnval += [stats]
+        return returnval
+
+    #======================== private =========================================
+
+    def _steps(self, steps, src, channel, start, end):
+        if self.by == BY_TIME:
+            return len(steps.get((src, channel), ()))
+        # the transactions of the window, which all have a step on this link
+        if self.transaction_count is not None:
+            end = min(end, self.transaction_count)
+        return max(0, int(math.ceil(end))-int(math.ceil(start)))
+
+    def _close_pane(self):
+        returnval = self.window(self.current)
+
+        # forget the pane no window needs anymore
+        self.panes.pop(self.current-self.npanes+1, None)
+        self.current += 1
+        return returnval
@@ -0,0 +1,482 @@
+import os
+import copy
+import signal
+import threading
+import multiprocessing
+import multiprocessing.pool
+
+import MoteHandler
+import DatasetWriter
+import RecordStream
+import RssiHistogram
+import MercatorDefines as d
+
+EVENT_UP      = 'up'
+EVENT_RESET   = 'reset'
+
+PHASE_VERIFY  = 'verify'
+PHASE_IDLE    = 'idle'
+PHASE_RX      = 'rx'
+
+PIPELINE_THREADS = 64   # maximum number of motes prepared concurrently
+
+
+class MoteGroup(object):
+    """
+    The motes driven by an experiment, all handled in this process.
+
+    Received packets are written to the current dataset, and published to
+    stream if given (an object with a publish(frame) method, see
+    RecordStream); restarts (IND_UP) and reset requests are reported through
+    event_cb(event, serialport). Extra keyword arguments are passed on to
+    each MoteHandler.
+    """
+
+    def __init__(self, serialports, event_cb=None, connect_timeout=MoteHandler.CONNECT_TIMEOUT, stream=None,
+                 **kwargs):
+
+        # local variables
+        self.event_cb             = event_cb
+        self.stream               = stream
+        self.dataLock             = threading.Lock()
+        self.waitTxDone           = threading.Event()
+        self.rxContext            = {}
+        self.rxCount              = {}
+        self.histograms           = {}
+        self.writer               = None
+        self.pool                 = None
+
+        # connect to motes
+        (self.motes, self.failed) = MoteHandler.connect_motes(
+            serialports,
+            reset_cb              = self._reset_cb,
+            handlers              = {
+                d.TYPE_IND_TXDONE:  self._txdone_cb,
+                d.TYPE_IND_RX:      self._rx_cb,
+                d.TYPE_IND_UP:      self._up_cb,
+            },
+            timeout               = connect_timeout,
+            **kwargs
+        )
+        self.macs                 = dict([(sp, mh.get_mac()) for (sp, mh) in self.motes.items()])
+
+    #======================== public ==========================================
+
+    def ports(self):
+        return sorted(self.macs.keys())
+
+    #=== dataset
+
+    def open_dataset(self, filename, settings=None, output=DatasetWriter.OUTPUT_ROWS,
+                     bad_frames=DatasetWriter.BAD_FRAMES_ROWS, segment_rows=0, segment_minutes=0):
+        with self.dataLock:
+            self.histograms       = {}
+            self.writer = DatasetWriter.WRITERS[output](
+                filename,
+                settings,
+                bad_frames,
+                segment_rows      = segment_rows,
+                segment_minutes   = segment_minutes,
+            )
+
+    def close_dataset(self):
+        with self.dataLock:
+            writer      = self.writer
+            self.writer = None
+        writer.close()
+        return writer.rows
+
+    #=== requests
+
+    def idle(self, ports):
+        for sp in ports:
+            self.motes[sp].send_REQ_IDLE()
+
+    def state(self, ports):
+        return dict([(sp, self.motes[sp].send_REQ_ST()) for sp in ports])
+
+    def stats(self, ports):
+        return dict([(sp, self.motes[sp].get_stats()) for sp in ports])
+
+    def rtts(self, ports):
+        """
+        :returns: the smoothed REQ_ST round-trip time of each mote, None if not measured
+        """
+        return dict([(sp, self.motes[sp].get_srtt()) for sp in ports])
+
+    def rx_counts(self, ports):
+        """
+        :returns: the number of IND_RX received by each mote since it was last switched to RX
+        """
+        with self.dataLock:
+            return dict([(sp, self.rxCount.get(sp, 0)) for sp in ports])
+
+    def rssi_histograms(self, reset=False):
+        """
+        :returns: the RssiHistogram of the packets received correctly on each
+                  (src, dst, channel) link since the last reset
+        """
+        with self.dataLock:
+            if not reset:
+                return copy.deepcopy(self.histograms)
+            returnval             = self.histograms
+            self.histograms       = {}
+        return returnval
+
+    def rx(self, ports, frequency, srcmac, transctr, txpksize, txfillbyte):
+        for sp in ports:
+            with self.dataLock:
+                writer             = self.writer
+                previous           = self.rxContext.get(sp)
+                self.rxContext[sp] = (srcmac, frequency, transctr)
+                self.rxCount[sp]   = 0
+            # the link of the previous step is complete
+            if writer is not None and previous is not None:
+                (prevsrc, prevfreq, prevtrans) = previous
+                writer.end_link(prevsrc, self.macs[sp], prevfreq, prevtrans)
+            self.motes[sp].send_REQ_RX(
+                frequency         = frequency,
+                srcmac            = srcmac,
+                transctr          = transctr,
+                txpksize          = txpksize,
+                txfillbyte        = txfillbyte,
+            )
+
+    def detach(self, ports):
+        """
+        Leave motes out of the experiment: their current link ends, the
+        IND_RX they still send are dropped, and they are switched to idle.
+        rx() takes them back.
+        """
+        for sp in ports:
+            with self.dataLock:
+                writer             = self.writer
+                previous           = self.rxContext.pop(sp, None)
+            if writer is not None and previous is not None:
+                (prevsrc, prevfreq, prevtrans) = previous
+                writer.end_link(prevsrc, self.macs[sp], prevfreq, prevtrans)
+            self.motes[sp].send_REQ_IDLE()
+
+    def prepare(self, ports, check, verify, **rxargs):
+        """
+        Prepare motes for the next transmitter step, one mote at a time but
+        many motes concurrently.
+
+        Each mote is asked for its state if it is in verify (the expected
+        states after the previous step), switched to idle, checked, switched
+        to RX with rxargs and checked again. States are only requested from
+        the motes in check.
+
+        :returns: a dictionary mapping each port to the states retrieved for
+                  it, by phase (PHASE_VERIFY, PHASE_IDLE, PHASE_RX)
+        """
+
+        check = set(check)
+
+        def _prepare(sp):
+            mh        = self.motes[sp]
+            returnval = {}
+            if sp in check and sp in verify:
+                returnval[PHASE_VERIFY] = mh.send_REQ_ST()
+            mh.send_REQ_IDLE()
+            if sp in check:
+                returnval[PHASE_IDLE]   = mh.send_REQ_ST()
+            self.rx([sp], **rxargs)
+            if sp in check:
+                returnval[PHASE_RX]     = mh.send_REQ_ST()
+            return (sp, returnval)
+
+        if not ports:
+            return {}
+        if self.pool is None:
+            self.pool = multiprocessing.pool.ThreadPool(max(1, min(len(self.motes), PIPELINE_THREADS)))
+        return dict(self.pool.map(_prepare, ports))
+
+    def tx(self, port, maxwaittime, **kwargs):
+        """
+        Have a mote transmit and wait for its IND_TXDONE.
+
+        :returns: True if the transmission completed within maxwaittime
+        """
+        with self.dataLock:
+            self.waitTxDone       = threading.Event()
+        self.motes[port].send_REQ_TX(**kwargs)
+        self.waitTxDone.wait(maxwaittime)
+        return self.waitTxDone.isSet()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+        for mh in self.motes.values():
+            mh.close()
+
+    #======================== private =========================================
+
+    def _txdone_cb(self, serialport, notif):
+        with self.dataLock:
+            self.waitTxDone.set()
+
+    def _rx_cb(self, serialport, notif):
+        with self.dataLock:
+            # not switched to RX yet, or detached
+            if serialport not in self.rxContext:
+                return
+            writer                        = self.writer
+            (srcmac, frequency, transctr) = self.rxContext[serialport]
+            self.rxCount[serialport]     += 1
+            if notif.crc and notif.expected:
+                key = (srcmac, self.macs[serialport], frequency)
+                if key not in self.histograms:
+                    self.histograms[key]  = RssiHistogram.RssiHistogram()
+                self.histograms[key].add(notif.rssi)
+        if self.stream is not None:
+            self.stream.publish(RecordStream.pack_rx(
+                src       = srcmac,
+                dst       = self.macs[serialport],
+                channel   = frequency,
+                rssi      = notif.rssi,
+                crc       = notif.crc,
+                expected  = notif.expected,
+                transctr  = transctr,
+                pkctr     = notif.pkctr,
+            ))
+        if writer is None:
+            return
+        writer.write_rx(
+            src       = srcmac,
+            dst       = self.macs[serialport],
+            channel   = frequency,
+            rssi      = notif.rssi,
+            crc       = notif.crc,
+            expected  = notif.expected,
+            transctr  = transctr,
+            pkctr     = notif.pkctr,
+        )
+
+    def _up_cb(self, serialport, notif):
+        self._event(EVENT_UP, serialport)
+
+    def _reset_cb(self, mote):
+        self._event(EVENT_RESET, mote.serialport)
+
+    def _event(self, event, serialport):
+        if self.event_cb:
+            self.event_cb(event, serialport)
+
+
+class ShardedMoteGroup(object):
+    """
+    The motes driven by an experiment, spread over several worker processes.
+
+    Each shard runs a MoteGroup, with its own MoteHandlers and dataset
+    writer, in a separate process; this coordinator sends it requests over a
+    pipe and merges the per-shard datasets when a dataset is closed. Events
+    raised in a shard are delivered to event_cb with the next reply, and
+    the frames it publishes are forwarded to stream through a queue.
+    """
+
+    def __init__(self, serialports, nbshards, event_cb=None, connect_timeout=MoteHandler.CONNECT_TIMEOUT,
+                 stream=None, **kwargs):
+
+        # local variables
+        self.event_cb             = event_cb
+        self.forwarder            = None
+        self.conns                = []
+        self.processes            = []
+        self.owner                = {}
+        self.macs                 = {}
+        self.failed               = {}
+        self.filename             = None
+        self.settings             = None
+        self.output               = None
+        self.bad_frames           = None
+        self.seq                  = 0
+
+        # forward the frames published by the shards
+        if stream is not None:
+            queue                 = multiprocessing.Queue(RecordStream.FORWARD_QUEUE_SIZE)
+            kwargs                = dict(kwargs, stream=RecordStream.QueuePublisher(queue))
+            self.forwarder        = RecordStream.ForwardingThread(queue, stream)
+
+        # start one process per shard
+        for i in range(nbshards):
+            (conn, child_conn) = multiprocessing.Pipe()
+            p = multiprocessing.Process(
+                target            = _shard_main,
+                args              = (child_conn, serialports[i::nbshards], connect_timeout, kwargs),
+                name              = 'MoteShard{0}'.format(i),
+            )
+            p.daemon              = True
+            p.start()
+            self.conns           += [conn]
+            self.processes       += [p]
+
+        # collect connection results
+        for (i, conn) in enumerate(self.conns):
+            (macs, failed) = conn.recv()
+            for sp in macs:
+                self.owner[sp]    = i
+            self.macs.update(macs)
+            self.failed.update(failed)
+
+    #======================== public ==========================================
+
+    def ports(self):
+        return sorted(self.macs.keys())
+
+    #=== dataset
+
+    def open_dataset(self, filename, settings=None, output=DatasetWriter.OUTPUT_ROWS,
+                     bad_frames=DatasetWriter.BAD_FRAMES_ROWS, segment_rows=0, segment_minutes=0):
+        # segments would only be cut when the parts are merged, after the run
+        if segment_rows or segment_minutes:
+            raise SystemError('datasets written by shards cannot be segmented')
+        self.filename             = filename
+        self.settings             = settings
+        self.output               = output
+        self.bad_frames           = bad_frames
+        self._call_all('open_dataset', [(f, None, output, bad_frames) for f in self._part_filenames()])
+
+    def close_dataset(self):
+        self._call_all('close_dataset', [()]*len(self.conns))
+        parts = self._part_filenames()
+        rows  = DatasetWriter.merge_parts(self.filename, self.settings, parts, self.output)
+        if self.bad_frames == DatasetWriter.BAD_FRAMES_COUNT:
+            parts += [DatasetWriter.bad_frames_filename(p) for p in parts]
+            DatasetWriter.merge_parts(
+                DatasetWriter.bad_frames_filename(self.filename),
+                self.settings,
+                parts[len(self.conns):],
+                DatasetWriter.OUTPUT_BAD_FRAMES,
+            )
+        for p in parts:
+            os.remove(p)
+        return rows
+
+    #=== requests
+
+    def idle(self, ports):
+        self._call_per_shard('idle', ports)
+
+    def state(self, ports):
+        returnval = {}
+        for result in self._call_per_shard('state', ports):
+            returnval.update(result)
+        return returnval
+
+    def stats(self, ports):
+        returnval = {}
+        for result in self._call_per_shard('stats', ports):
+            returnval.update(result)
+        return returnval
+
+    def rtts(self, ports):
+        returnval = {}
+        for result in self._call_per_shard('rtts', ports):
+            returnval.update(result)
+        return returnval
+
+    def rx_counts(self, ports):
+        returnval = {}
+        for result in self._call_per_shard('rx_counts', ports):
+            returnval.update(result)
+        return returnval
+
+    def rssi_histograms(self, reset=False):
+        return RssiHistogram.merge_all(self._call_all('rssi_histograms', [(reset,)]*len(self.conns)))
+
+    def rx(self, ports, **kwargs):
+        self._call_per_shard('rx', ports, **kwargs)
+
+    def detach(self, ports):
+        self._call_per_shard('detach', ports)
+
+    def prepare(self, ports, check, verify, **rxargs):
+        returnval = {}
+        for result in self._call_per_shard('prepare', ports, check=check, verify=verify, **rxargs):
+            returnval.update(result)
+        return returnval
+
+    def tx(self, port, maxwaittime, **kwargs):
+        conn = self.conns[self.owner[port]]
+        seq  = self._send(conn, 'tx', (port, maxwaittime), kwargs)
+        return self._recv(conn, seq)
+
+    def close(self):
+        self._call_all('close', [()]*len(self.conns))
+        for p in self.processes:
+            p.join()
+        if self.forwarder is not None:
+            self.forwarder.stop()
+
+    #======================== private =========================================
+
+    def _part_filenames(self):
+        return ['{0}.part{1}'.format(self.filename, i) for i in range(len(self.conns))]
+
+    def _call_per_shard(self, cmd, ports, **kwargs):
+        byshard = {}
+        for sp in ports:
+            byshard.setdefault(self.owner[sp], []).append(sp)
+        seqs    = dict([(i, self._send(self.conns[i], cmd, (sps,), kwargs)) for (i, sps) in byshard.items()])
+        return [self._recv(self.conns[i], seqs[i]) for i in byshard]
+
+    def _call_all(self, cmd, args):
+        seqs = [self._send(conn, cmd, a, {}) for (conn, a) in zip(self.conns, args)]
+        return [self._recv(conn, seq) for (conn, seq) in zip(self.conns, seqs)]
+
+    def _send(self, conn, cmd, args, kwargs):
+        self.seq += 1
+        conn.send((self.seq, cmd, args, kwargs))
+        return self.seq
+
+    def _recv(self, conn, seq):
+        # skip the replies to requests interrupted before they were read
+        # (e.g. by KeyboardInterrupt), keeping their events
+        while True:
+            (replySeq, ok, result, events) = conn.recv()
+            for (event, serialport) in events:
+                if self.event_cb:
+                    self.event_cb(event, serialport)
+            if replySeq == seq:
+                break
+        if not ok:
+            raise SystemError(result)
+        return result
+
+#============================ helpers =========================================
+
+
+def _shard_main(conn, serialports, connect_timeout, kwargs):
+    """
+    Body of a shard process: serve requests from the coordinator until
+    asked to close.
+    """
+
+    # interruptions are handled by the coordinator
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    events     = []
+    eventLock  = threading.Lock()
+
+    def _event_cb(event, serialport):
+        with eventLock:
+            events.append((event, serialport))
+
+    group = MoteGroup(serialports, event_cb=_event_cb, connect_timeout=connect_timeout, **kwargs)
+    conn.send((group.macs, group.failed))
+
+    goOn = True
+    while goOn:
+        (seq, cmd, args, kwargs) = conn.recv()
+        try:
+            result = getattr(group, cmd)(*args, **kwargs)
+            ok     = True
+        except Exception as err:
+            result = '{0} failed in shard: {1}'.format(cmd, err)
+            ok     = False
+        with eventLock:
+            pending = events[:]
+            del events[:]
+        conn.send((seq, ok, result, pending))
+        goOn = (cmd != 'close')
@@ -7,24 +7,50 @@ import serial
 import socket
 
 import Hdlc
+import Notifications
+import SerialCapture
 import MercatorDefines as d
 
 BAUDRATE = 500000
 TIMEOUT_RESPONSE = 3
 MAX_TIMEOUTS = 3
+CONNECT_TIMEOUT = 30
+CLOSE_TIMEOUT = 1
+
+# response timeout (RTO), estimated from the measured round-trip time as in TCP (RFC 6298)
+RTO_MIN = 0.2
+RTO_MAX = TIMEOUT_RESPONSE
+RTT_ALPHA = 1/8.0
+RTT_BETA = 1/4.0
 
 STAT_UARTNUMRXCRCOK = 'uartNumRxCrcOk'
 STAT_UARTNUMRXCRCWRONG = 'uartNumRxCrcWrong'
 STAT_UARTNUMTX = 'uartNumTx'
 
 class MoteHandler(threading.Thread):
-
-    def __init__(self, serialport, cb=None, reset_cb=None):
+    """
+    Drives a mote over its serial port, and decodes what it sends from a
+    reception thread.
+
+    Notifications (see Notifications) are delivered to the handlers
+    subscribed to their type, as handler(serialport, notif): handlers maps
+    message types to handlers when they must get the first notifications,
+    subscribe() adds handlers later. Frames which cannot be decoded and
+    exceptions raised by handlers are delivered to the error handlers, as
+    handler(serialport, err), printed when there are none. cb, if given,
+    is subscribed to all notification types and to errors.
+    """
+
+    def __init__(self, serialport, cb=None, reset_cb=None, rto_min=RTO_MIN, rto_max=RTO_MAX,
+                 capture_dir=None, source=None, handlers=None, error_cb=None):
 
         self.serialport           = serialport
         self.cb                   = cb
         self.reset_cb             = reset_cb
+        self.rto_min              = rto_min
+        self.rto_max              = rto_max
         self.serialLock           = threading.Lock()
+        self.requestLock          = threading.Lock()
         self.dataLock             = threading.RLock()
         self.mac                  = None
         self.hdlc                 = Hdlc.Hdlc()
@@ -36,12 +62,36 @@ class MoteHandler(threading.Thread):
         self.waitResponseEvent    = None
         self.isActive             = True
         self.response             = None
+        self.responseTime         = None
+        self.sendTime             = None
+        self.retrying             = False
+        self.srtt                 = None
+        self.rttvar               = None
+        self.rto                  = rto_max
         self._iotlab              = False
         self.timeouts             = 0
+        self.capture              = None
+        self.handlers             = {}
+        self.errorHandlers        = []
+        self.dispatch             = {}
         self._reset_stats()
+        self._compile_dispatch()
+
+        # subscribe handlers before any notification arrives
+        for (msg_type, handler) in (handlers or {}).items():
+            self.subscribe(msg_type, handler)
+        if error_cb:
+            self.subscribe_errors(error_cb)
+        if cb:
+            for msg_type in Notifications.NOTIFICATIONS:
+                if msg_type != d.TYPE_RESP_ST:
+                    self.subscribe(msg_type, cb)
+            self.subscribe_errors(cb)
 
         try:
-            if self.iotlab:
+            if source is not None:
+                self.serial       = source
+            elif self.iotlab:
                 self.serial       = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.serial.connect((serialport, 20000))
             else:
@@ -51,6 +101,12 @@ class MoteHandler(threading.Thread):
             print msg
             raise SystemError(msg)
 
+        # record everything received
+        if capture_dir:
+            self.capture          = SerialCapture.CaptureWriter(
+                SerialCapture.capture_filename(capture_dir, serialport)
+            )
+
         threading.Thread.__init__(self)
         self.name                 = 'MoteHandler@{0}'.format(serialport)
         self.daemon               = True
@@ -58,8 +114,9 @@ class MoteHandler(threading.Thread):
         # start reception thread
         self.start()
 
-        # retrieve the state of the mote (to get MAC address)
-        self.send_REQ_ST()
+        # retrieve the state of the mote (to get MAC address), unless replaying
+        if source is None:
+            self.send_REQ_ST()
         # assert self.mac
 
     #======================== thread ==========================================
@@ -73,6 +130,13 @@ class MoteHandler(threading.Thread):
             else:
                 rx_byte = self.serial.read(1)
 
+            # connection closed, or end of replay
+            if not rx_byte:
+                break
+
+            if self.capture:
+                self.capture.write(rx_byte)
+
             with self.dataLock:
                 if      (
                             (not self.busyReceiving)               and
@@ -106,56 +170,51 @@ class MoteHandler(threading.Thread):
                         self.stats[STAT_UARTNUMRXCRCWRONG] += 1
                     else:
                         self.stats[STAT_UARTNUMRXCRCOK] += 1
-                        self._handle_inputbuf([ord(b) for b in self.inputBuf])
+                        self._handle_inputbuf(self.inputBuf)
 
                 self.lastRxByte = rx_byte
 
         self.serial.close()
+        if self.capture:
+            self.capture.close()
 
     #======================== public ==========================================
 
-    #=== stats
+    #=== subscriptions
 
-    def get_stats(self):
+    def subscribe(self, msg_type, handler):
+        """
+        Deliver the notifications of a type to handler(serialport, notif),
+        from the reception thread.
+        """
         with self.dataLock:
-            return copy.deepcopy(self.stats)
-
-    #=== requests
-
-    def send_REQ_ST(self):
+            self.handlers.setdefault(msg_type, []).append(handler)
+            self._compile_dispatch()
 
+    def unsubscribe(self, msg_type, handler):
         with self.dataLock:
-            # assert not self.waitResponse
-            self.waitResponseEvent     = threading.Event()
-            self.waitResponse          = True
+            self.handlers[msg_type].remove(handler)
+            self._compile_dispatch()
 
-        self._send(
-            struct.pack(
-                '>B',
-                d.TYPE_REQ_ST,
-            )
-        )
-
-        self.waitResponseEvent.wait(TIMEOUT_RESPONSE)
+    def subscribe_errors(self, handler):
+        """
+        Deliver undecodable frames and handler exceptions to handler(serialport, err).
+        """
+        with self.dataLock:
+            self.errorHandlers.append(handler)
 
-        if not self.waitResponseEvent.isSet():
-            print "-----------timeout--------------" + self.serialport
-            self.isActive = False
-            self.timeouts += 1
-            if self.timeouts > MAX_TIMEOUTS:
-                self.reset_cb(self)
-                self.timeouts = 0
-            return
-        else:
-            self.timeouts = 0
+    #=== stats
 
+    def get_stats(self):
         with self.dataLock:
-            self.waitResponse          = False
-            self.waitResponseEvent     = False
-            return_val = copy.deepcopy(self.response)
-            self.response              = None
+            return copy.deepcopy(self.stats)
 
-        return return_val
+    #=== requests
+
+    def send_REQ_ST(self):
+        # one exchange at a time: the pending request is kept in single attributes
+        with self.requestLock:
+            return self._exchange_REQ_ST()
 
     def send_REQ_IDLE(self):
         self._send(
@@ -198,6 +257,33 @@ class MoteHandler(threading.Thread):
         with self.dataLock:
             return self.mac
 
+    def get_rto(self):
+        with self.dataLock:
+            return self.rto
+
+    def get_srtt(self):
+        with self.dataLock:
+            return self.srtt
+
+    #=== connection
+
+    def close(self):
+        """
+        Stop the reception thread and release the serial port.
+        """
+        self.goOn = False
+        try:
+            if self.iotlab:
+                self.serial.shutdown(socket.SHUT_RDWR)
+            elif hasattr(self.serial, 'cancel_read'):
+                self.serial.cancel_read()
+        except (socket.error, serial.SerialException):
+            pass
+
+        # let the reception thread complete the capture file
+        if self.capture and threading.current_thread() is not self:
+            self.join(CLOSE_TIMEOUT)
+
     #======================== private =========================================
 
     #=== stats
@@ -210,106 +296,119 @@ class MoteHandler(threading.Thread):
                 STAT_UARTNUMTX            : 0,
             }
 
-    #=== serial rx
+    #=== requests
 
-    def _handle_inputbuf(self, input_buf):
+    def _exchange_REQ_ST(self):
 
-        try:
+        with self.dataLock:
+            # a reply which arrives from now on answers this request
+            self.response              = None
+            self.responseTime          = None
+            self.waitResponseEvent     = threading.Event()
+            self.waitResponse          = True
+            self.sendTime              = time.time()
+            event                      = self.waitResponseEvent
+            sendTime                   = self.sendTime
+            rto                        = self.rto
+
+        self._send(
+            struct.pack(
+                '>B',
+                d.TYPE_REQ_ST,
+            )
+        )
+
+        event.wait(rto)
 
-            inputtype = input_buf[0]
-
-            if   inputtype == d.TYPE_IND_TXDONE:
-
-                # parse input
-                [msg_type] = \
-                    struct.unpack(">B", ''.join([chr(b) for b in input_buf]))
-
-                # notify higher layer
-                self.cb(
-                    serialport = self.serialport,
-                    notif      = {
-                        'type':             msg_type,
-                    }
-                )
-
-            elif inputtype == d.TYPE_IND_RX:
-
-                # parse input
-                [msg_type, length, rssi, flags, pkctr] = \
-                    struct.unpack(">BBbBH", ''.join([chr(b) for b in input_buf]))
-                if flags & (1 << 7) != 0:
-                    crc = 1
-                else:
-                    crc = 0
-
-                if flags & (1 << 6) != 0:
-                    expected = 1
-                else:
-                    expected = 0
-
-                if crc == 0 or expected == 0:
-                    pkctr = 0
-
-                # notify higher layer
-                self.cb(
-                    serialport = self.serialport,
-                    notif      = {
-                        'type':             msg_type,
-                        'length':           length,
-                        'rssi':             rssi,
-                        'crc':              crc,
-                        'expected':         expected,
-                        'pkctr':            pkctr,
-                    }
-                )
-
-            elif inputtype == d.TYPE_RESP_ST:
-
-                # parse input
-                [msg_type, status, numnotifications, m1, m2, m3, m4, m5, m6, m7, m8] = \
-                    struct.unpack(">BBHBBBBBBBB", ''.join([chr(b) for b in input_buf]))
-
-                # remember this mote's MAC address
-                with self.dataLock:
-                    self.mac = (m1, m2, m3, m4, m5, m6, m7, m8)
-
-                # send response as return code
-                with self.dataLock:
-                    # assert self.waitResponse
-                    self.response = {
-                        'type':             msg_type,
-                        'status':           status,
-                        'numnotifications': numnotifications,
-                        'mac':              (m1, m2, m3, m4, m5, m6, m7, m8),
-                    }
-                    self.waitResponseEvent.set()
-
-            elif inputtype == d.TYPE_IND_UP:
-
-                # parse input
-                [msg_type] = \
-                    struct.unpack(">B", ''.join([chr(b) for b in input_buf]))
-
-                # notify higher layer
-                self.cb(
-                    serialport = self.serialport,
-                    notif      = {
-                        'type':             msg_type,
-                        }
-                    )
+        with self.dataLock:
+            self.waitResponse          = False
+            self.waitResponseEvent     = None
+            response                   = self.response
+            responseTime               = self.responseTime
+            self.response              = None
 
+        if response is None or responseTime < sendTime:
+            print "-----------timeout--------------" + self.serialport
+            with self.dataLock:
+                self.rto = min(2*self.rto, self.rto_max)
+                # the next reply may answer this request: do not time it (Karn)
+                self.retrying = True
+            self.isActive = False
+            self.timeouts += 1
+            if self.timeouts > MAX_TIMEOUTS and self.reset_cb:
+                self.reset_cb(self)
+                self.timeouts = 0
+            return
+        else:
+            self.timeouts = 0
+
+        with self.dataLock:
+            if self.retrying:
+                self.retrying          = False
             else:
+                self._update_rto(responseTime-sendTime)
+
+        return response
 
-                raise SystemError('unknown notification type {0}'.format(input_buf[0]))
+    #=== timeouts
 
+    def _update_rto(self, rtt):
+        if self.srtt is None:
+            self.srtt    = rtt
+            self.rttvar  = rtt/2
+        else:
+            self.rttvar  = (1-RTT_BETA)*self.rttvar+RTT_BETA*abs(self.srtt-rtt)
+            self.srtt    = (1-RTT_ALPHA)*self.srtt+RTT_ALPHA*rtt
+        self.rto         = min(max(self.srtt+4*self.rttvar, self.rto_min), self.rto_max)
+
+    #=== serial rx
+
+    def _handle_inputbuf(self, input_buf):
+
+        try:
+            notif = Notifications.unpack(input_buf)
+            self.dispatch.get(notif.type, _ignore)(self.serialport, notif)
         except Exception as err:
+            self._error(err)
 
-            print err
+    def _handle_resp_st(self, serialport, notif):
 
-            self.cb(
-                serialport = self.serialport,
-                notif      = err,
-            )
+        # remember this mote's MAC address
+        with self.dataLock:
+            self.mac          = notif.mac
+
+            # send response as return code, unless nobody waits for it (late
+            # reply to a request which timed out, or replaying a capture)
+            now = time.time()
+            if not self.waitResponse or now < self.sendTime:
+                return
+            self.responseTime = now
+            self.response     = notif
+            self.waitResponseEvent.set()
+
+    def _compile_dispatch(self):
+        # one callable per message type, replaced at once: the reception
+        # thread reads it without locking
+        handlers = dict([(t, list(h)) for (t, h) in self.handlers.items()])
+        handlers.setdefault(d.TYPE_RESP_ST, []).insert(0, self._handle_resp_st)
+        dispatch = {}
+        for (msg_type, h) in handlers.items():
+            if len(h) == 1:
+                dispatch[msg_type] = h[0]
+            elif h:
+                dispatch[msg_type] = _fanout(h, self._error)
+        self.dispatch = dispatch
+
+    def _error(self, err):
+        with self.dataLock:
+            handlers = list(self.errorHandlers)
+        if not handlers:
+            print err
+        for handler in handlers:
+            try:
+                handler(self.serialport, err)
+            except Exception as handlerErr:
+                print handlerErr
 
     #=== serial tx
 
@@ -335,3 +434,85 @@ class MoteHandler(threading.Thread):
             self._iotlab = True
 
         return self._iotlab
+
+#============================ helpers =========================================
+
+
+def _ignore(serialport, notif):
+    pass
+
+
+def _fanout(handlers, error_cb):
+    # one faulty handler does not keep the notification from the others
+    def _handler(serialport, notif):
+        for handler in handlers:
+            try:
+                handler(serialport, notif)
+            except Exception as err:
+                error_cb(err)
+    return _handler
+
+
+def connect_motes(serialports, cb=None, reset_cb=None, timeout=CONNECT_TIMEOUT, **kwargs):
+    """
+    Connect to several motes concurrently.
+
+    Each serial port is opened from its own thread, so a slow or dead node
+    only costs its own connection time. Motes which have not answered their
+    initial REQ_ST when the global deadline expires are dropped; handlers
+    which complete after the deadline are closed as soon as they do.
+
+    :param list serialports: the serial ports (or IoT-LAB node names) to connect to
+    :param int timeout: the global deadline for all connections, in seconds
+    :param kwargs: passed on to each MoteHandler (e.g. rto_min, rto_max)
+    :returns: a (motes, failed) tuple; motes maps each responsive serial port
+              to its MoteHandler, failed maps each unresponsive serial port
+              to the reason it was dropped
+    """
+
+    results      = {}
+    resultLock   = threading.Lock()
+    expired      = [False]
+
+    def _connect(serialport):
+        try:
+            result = MoteHandler(serialport, cb, reset_cb=reset_cb, **kwargs)
+        except Exception as err:
+            result = err
+        with resultLock:
+            if expired[0]:
+                if isinstance(result, MoteHandler):
+                    result.close()
+                return
+            results[serialport] = result
+
+    threads = []
+    for s in serialports:
+        t = threading.Thread(target=_connect, args=(s,))
+        t.name   = 'connect@{0}'.format(s)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    # wait for all connections, up to the global deadline
+    deadline = time.time()+timeout
+    for t in threads:
+        t.join(max(0, deadline-time.time()))
+
+    motes  = {}
+    failed = {}
+    with resultLock:
+        expired[0] = True
+        for s in serialports:
+            result = results.get(s)
+            if result is None:
+                failed[s] = 'no connection after {0}s'.format(timeout)
+            elif isinstance(result, Exception):
+                failed[s] = str(result)
+            elif not result.isActive or result.get_mac() is None:
+                result.close()
+                failed[s] = 'no answer to REQ_ST'
+            else:
+                motes[s] = result
+
+    return (motes, failed)
@@ -0,0 +1,126 @@
+import threading
+
+QUARANTINE_SCORE     = 3     # health score at which a node is quarantined
+REPROBE_INTERVAL     = 16    # number of steps between two probes of a quarantined node
+CRC_ERRORS_PER_POINT = 10    # number of UART CRC errors worth one point of score
+
+EVENT_QUARANTINE     = 'quarantine'
+EVENT_RELEASE        = 'release'
+
+
+class NodeHealth(object):
+    """
+    Keeps a health score per node and decides which nodes are quarantined.
+
+    The score of a node is its number of consecutive timeouts, plus its
+    restarts (IND_UP) and one point per CRC_ERRORS_PER_POINT UART CRC errors.
+    Every answer clears the timeouts and halves the rest, so a node which
+    recovers is trusted again quickly. A node reaching the quarantine score
+    is left out of the experiment, and probed every reprobe_interval steps
+    until it answers again.
+
+    Quarantine and release are reported through event_cb(event, serialport, score).
+    """
+
+    def __init__(self, quarantine_score=QUARANTINE_SCORE, reprobe_interval=REPROBE_INTERVAL, event_cb=None):
+
+        # slot params
+        self.quarantine_score     = quarantine_score
+        self.reprobe_interval     = reprobe_interval
+        self.event_cb             = event_cb
+
+        # local variables
+        self.dataLock             = threading.RLock()
+        self.nodes                = {}
+        self.quarantined          = {}
+        self.stepctr              = 0
+
+    #======================== public ==========================================
+
+    def record_answer(self, serialport):
+        with self.dataLock:
+            node                  = self._node(serialport)
+            node['timeouts']      = 0
+            node['restarts']     /= 2.0
+            node['crcerrors']    /= 2.0
+
+    def record_timeout(self, serialport):
+        with self.dataLock:
+            self._node(serialport)['timeouts'] += 1
+            self._update(serialport)
+
+    def record_restart(self, serialport):
+        with self.dataLock:
+            self._node(serialport)['restarts'] += 1
+            self._update(serialport)
+
+    def record_crc_errors(self, serialport, num):
+        if not num:
+            return
+        with self.dataLock:
+            self._node(serialport)['crcerrors'] += num
+            self._update(serialport)
+
+    def score(self, serialport):
+        with self.dataLock:
+            node = self._node(serialport)
+            return node['timeouts']+node['restarts']+node['crcerrors']/float(CRC_ERRORS_PER_POINT)
+
+    def is_quarantined(self, serialport):
+        with self.dataLock:
+            return serialport in self.quarantined
+
+    def active(self, ports):
+        """
+        :returns: the ports which are not quarantined, in the same order
+        """
+        with self.dataLock:
+            return [sp for sp in ports if sp not in self.quarantined]
+
+    def step(self):
+        """
+        Advance to the next step.
+
+        :returns: the quarantined ports which are due a probe
+        """
+        with self.dataLock:
+            self.stepctr         += 1
+            returnval             = []
+            for (sp, laststep) in self.quarantined.items():
+                if self.stepctr-laststep >= self.reprobe_interval:
+                    self.quarantined[sp] = self.stepctr
+                    returnval    += [sp]
+            return sorted(returnval)
+
+    def release(self, serialport):
+        """
+        Take a node out of quarantine, after it answered a probe.
+        """
+        with self.dataLock:
+            if serialport not in self.quarantined:
+                return
+            del self.quarantined[serialport]
+            del self.nodes[serialport]
+        self._event(EVENT_RELEASE, serialport, 0)
+
+    #======================== private =========================================
+
+    def _node(self, serialport):
+        if serialport not in self.nodes:
+            self.nodes[serialport] = {
+                'timeouts':       0,
+                'restarts':       0,
+                'crcerrors':      0,
+            }
+        return self.nodes[serialport]
+
+    def _update(self, serialport):
+        score = self.score(serialport)
+        if serialport in self.quarantined or score < self.quarantine_score:
+            return
+        self.quarantined[serialport] = self.stepctr
+        self._event(EVENT_QUARANTINE, serialport, score)
+
+    def _event(self, event, serialport, score):
+        if self.event_cb:
+            self.event_cb(event, serialport, score)
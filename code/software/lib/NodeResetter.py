@@ -0,0 +1,156 @@
+import time
+import logging
+import threading
+
+RESET_COALESCE = 1.0   # time to wait for more failing nodes before calling the API, in s
+RESET_GRACE    = 15    # time a node is considered being reset after the API call, in s
+
+
+class NodeResetter(threading.Thread):
+    """
+    Resets IoT-LAB nodes from a background thread.
+
+    Requests are queued and return immediately. Nodes which fail within
+    RESET_COALESCE seconds of each other are reset with a single API call.
+    A node is reported as being reset from its request until it restarts
+    (see done()) or RESET_GRACE seconds after the API call returned.
+
+    node_command has the signature of iotlabcli.node.node_command; pass
+    LocalNodeApi().node_command to run without the testbed.
+    """
+
+    def __init__(self, node_command, api, experiment_id, site,
+                 coalesce=RESET_COALESCE, grace=RESET_GRACE):
+
+        # slot params
+        self.node_command         = node_command
+        self.api                  = api
+        self.experiment_id        = experiment_id
+        self.site                 = site
+        self.coalesce             = coalesce
+        self.grace                = grace
+
+        # local variables
+        self.dataLock             = threading.Lock()
+        self.newRequest           = threading.Event()
+        self.pending              = []
+        self.resetting            = {}
+        self.goOn                 = True
+        self.log                  = logging.getLogger('NodeResetter')
+
+        # initialize parent class
+        threading.Thread.__init__(self)
+        self.name                 = 'NodeResetter'
+        self.daemon               = True
+
+        self.start()
+
+    #======================== thread ==========================================
+
+    def run(self):
+
+        while self.goOn:
+
+            self.newRequest.wait()
+            if not self.goOn:
+                break
+
+            # give other failing nodes a chance to join this reset
+            time.sleep(self.coalesce)
+
+            with self.dataLock:
+                self.newRequest.clear()
+                serialports       = self.pending
+                self.pending      = []
+                for sp in serialports:
+                    self.resetting[sp] = None
+
+            if not serialports:
+                continue
+
+            self.log.debug('resetting %s', ', '.join(serialports))
+            try:
+                self.node_command(
+                    self.api,
+                    'reset',
+                    self.experiment_id,
+                    [node_url(sp, self.site) for sp in serialports],
+                )
+            except Exception as err:
+                self.log.warning('could not reset %s: %s', ', '.join(serialports), err)
+                with self.dataLock:
+                    for sp in serialports:
+                        self.resetting.pop(sp, None)
+            else:
+                with self.dataLock:
+                    for sp in serialports:
+                        if sp in self.resetting:
+                            self.resetting[sp] = time.time()+self.grace
+
+    #======================== public ==========================================
+
+    def request(self, serialport):
+        """
+        Queue a reset of a node, unless one is already in progress.
+        """
+        with self.dataLock:
+            if serialport in self.pending or self._is_resetting(serialport):
+                return
+            self.pending         += [serialport]
+            self.newRequest.set()
+
+    def done(self, serialport):
+        """
+        Signal that a node has restarted.
+        """
+        with self.dataLock:
+            self.resetting.pop(serialport, None)
+
+    def is_resetting(self, serialport):
+        with self.dataLock:
+            return serialport in self.pending or self._is_resetting(serialport)
+
+    def stop(self):
+        self.goOn = False
+        self.newRequest.set()
+
+    #======================== private =========================================
+
+    def _is_resetting(self, serialport):
+        if serialport not in self.resetting:
+            return False
+        deadline = self.resetting[serialport]
+        if deadline is not None and deadline < time.time():
+            del self.resetting[serialport]
+            return False
+        return True
+
+
+class LocalNodeApi(object):
+    """
+    Stand-in for the IoT-LAB REST API node commands, for use without the
+    testbed (e.g. in tests).
+
+    Every call is recorded in calls; on_command, if given, is called with the
+    command and the list of node URLs, e.g. to simulate the nodes restarting.
+    """
+
+    def __init__(self, delay=0, on_command=None):
+        self.delay                = delay
+        self.on_command           = on_command
+        self.calls                = []
+        self.dataLock             = threading.Lock()
+
+    def node_command(self, api, command, exp_id, nodes_list=()):
+        with self.dataLock:
+            self.calls           += [(command, exp_id, list(nodes_list))]
+        time.sleep(self.delay)
+        if self.on_command:
+            self.on_command(command, list(nodes_list))
+        return dict([(n, '0') for n in nodes_list])
+
+#============================ helpers =========================================
+
+
+def node_url(serialport, site):
+    return ".".join([serialport, site, "iot-lab.info"])
@@ -0,0 +1,150 @@
+import struct
+
+import MercatorDefines as d
+
+
+class Notification(object):
+    """
+    A message received from a mote, decoded.
+
+    One class per message type, with the fields of the message as slots, so
+    a notification is a small fixed-size object rather than a dictionary.
+    Messages without fields are decoded to a shared instance. type is a
+    class attribute; FORMAT is the struct format of the message.
+    """
+
+    __slots__ = ()
+
+    type      = None
+    FORMAT    = '>B'
+
+    #======================== public ==========================================
+
+    @classmethod
+    def unpack(cls, data):
+        """
+        :param data: the message, without HDLC framing, type byte included
+        """
+        return cls(*struct.unpack(cls.FORMAT, data)[1:])
+
+    def as_dict(self):
+        """
+        :returns: the fields of the notification, and its type, as a dictionary
+        """
+        returnval = dict([(k, getattr(self, k)) for k in self.__slots__])
+        returnval['type'] = self.type
+        return returnval
+
+    #======================== private =========================================
+
+    def __getstate__(self):
+        return tuple([getattr(self, k) for k in self.__slots__])
+
+    def __setstate__(self, state):
+        for (k, v) in zip(self.__slots__, state):
+            setattr(self, k, v)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '{0}({1})'.format(
+            type(self).__name__,
+            ', '.join(['{0}={1!r}'.format(k, getattr(self, k)) for k in self.__slots__]),
+        )
+
+
+class IndTxDone(Notification):
+
+    __slots__ = ()
+
+    type      = d.TYPE_IND_TXDONE
+
+    @classmethod
+    def unpack(cls, data):
+        return IND_TXDONE
+
+
+class IndRx(Notification):
+    """
+    crc and expected are 1 or 0. pkctr is 0 unless both are 1.
+    """
+
+    __slots__ = ('length', 'rssi', 'crc', 'expected', 'pkctr')
+
+    type      = d.TYPE_IND_RX
+    FORMAT    = '>BBbBH'
+
+    def __init__(self, length, rssi, crc, expected, pkctr):
+        self.length               = length
+        self.rssi                 = rssi
+        self.crc                  = crc
+        self.expected             = expected
+        self.pkctr                = pkctr
+
+    @classmethod
+    def unpack(cls, data):
+        (_, length, rssi, flags, pkctr) = struct.unpack(cls.FORMAT, data)
+        crc      = (flags >> 7) & 1
+        expected = (flags >> 6) & 1
+        if not (crc and expected):
+            pkctr = 0
+        return cls(length, rssi, crc, expected, pkctr)
+
+
+class RespSt(Notification):
+
+    __slots__ = ('status', 'numnotifications', 'mac')
+
+    type      = d.TYPE_RESP_ST
+    FORMAT    = '>BBH8B'
+
+    def __init__(self, status, numnotifications, mac):
+        self.status               = status
+        self.numnotifications     = numnotifications
+        self.mac                  = mac
+
+    @classmethod
+    def unpack(cls, data):
+        fields = struct.unpack(cls.FORMAT, data)
+        return cls(fields[1], fields[2], fields[3:])
+
+
+class IndUp(Notification):
+
+    __slots__ = ()
+
+    type      = d.TYPE_IND_UP
+
+    @classmethod
+    def unpack(cls, data):
+        return IND_UP
+
+IND_TXDONE = IndTxDone()
+IND_UP     = IndUp()
+
+# notification class of each message type received from the motes
+NOTIFICATIONS = {
+    d.TYPE_IND_TXDONE:  IndTxDone,
+    d.TYPE_IND_RX:      IndRx,
+    d.TYPE_RESP_ST:     RespSt,
+    d.TYPE_IND_UP:      IndUp,
+}
+
+#============================ helpers =========================================
+
+
+def unpack(data):
+    """
+    Decode a message received from a mote.
+
+    :param data: the message, without HDLC framing
+    :returns: a Notification
+    """
+    msg_type = ord(data[0])
+    if msg_type not in NOTIFICATIONS:
+        raise SystemError('unknown notification type {0}'.format(msg_type))
+    return NOTIFICATIONS[msg_type].unpack(data)
@@ -4,6 +4,12 @@ import threading
 import logging
 import time
 from   datetime import timedelta
+from   multiprocessing.pool import ThreadPool
+
+WORKERS       = 4      # user commands running at once
+
+JOB_QUEUED    = 'queued'
+JOB_RUNNING   = 'running'
 
 
 class NullLogHandler(logging.Handler):
@@ -11,15 +17,44 @@ class NullLogHandler(logging.Handler):
         pass
 
 
+class Job(object):
+    """
+    \brief A user command, run by the worker pool of an OpenCli.
+
+    Cancelling a job skips it if it has not started yet; a running command
+    stops at its next check of cancelled().
+    """
+
+    def __init__(self, jobid, command):
+
+        # slot params
+        self.id              = jobid
+        self.command         = command
+
+        # local variables
+        self.status          = JOB_QUEUED
+        self.startTime       = time.time()
+        self.cancelEvent     = threading.Event()
+
+    def cancel(self):
+        self.cancelEvent.set()
+
+    def cancelled(self):
+        return self.cancelEvent.isSet()
+
+
 class OpenCli(threading.Thread):
     """
     \brief Thread which handles CLI commands entered by the user.
+
+    User commands run as jobs on a pool of worker threads, so the prompt
+    returns at once; system commands run on this thread.
     """
 
     CMD_LEVEL_USER   = "user"
     CMD_LEVEL_SYSTEM = "system"
 
-    def __init__(self, app_name, quit_cb):
+    def __init__(self, app_name, quit_cb, workers=WORKERS):
 
         # slot params
         self.appName         = app_name
@@ -30,6 +65,11 @@ class OpenCli(threading.Thread):
         self.commands        = []
         self.goOn            = True
         self.startTime       = 0
+        self.jobLock         = threading.Lock()
+        self.jobs            = {}
+        self.lastJobId       = 0
+        self.pool            = ThreadPool(workers)
+        self.local           = threading.local()
 
         # logging
         self.log             = logging.getLogger('OpenCli')
@@ -71,6 +111,20 @@ class OpenCli(threading.Thread):
                 'how long this application has been running',
                 [],
                 self._handle_uptime)
+        self._register_command_internal(
+                self.CMD_LEVEL_SYSTEM,
+                'jobs',
+                'j',
+                'list the commands still running',
+                [],
+                self._handle_jobs)
+        self._register_command_internal(
+                self.CMD_LEVEL_SYSTEM,
+                'cancel',
+                'ca',
+                'cancel a running command',
+                ['jobid'],
+                self._handle_cancel)
 
     def run(self):
         banner  = []
@@ -112,6 +166,7 @@ class OpenCli(threading.Thread):
             for command in self.commands:
                 if command['name'] == params[0] or command['alias'] == params[0]:
                     found = True
+                    cmd_level      = command['cmd_level']
                     cmd_params     = command['params']
                     cmd_callback   = command['callback']
                     break
@@ -120,7 +175,10 @@ class OpenCli(threading.Thread):
             # call its callback or print error message
             if found:
                 if len(params[1:]) == len(cmd_params):
-                    cmd_callback(params[1:])
+                    if cmd_level == self.CMD_LEVEL_SYSTEM:
+                        self._call(cmd_callback, params[1:])
+                    else:
+                        self._submit(' '.join(params), cmd_callback, params[1:])
                 else:
                     if not self._print_usage_from_name(params[0]):
                         self._print_usage_from_alias(params[0])
@@ -138,8 +196,45 @@ class OpenCli(threading.Thread):
                                         params,
                                         callback)
 
+    def current_job(self):
+        """
+        \brief The Job of the command running on the calling thread, None
+               outside of the worker pool.
+        """
+        return getattr(self.local, 'job', None)
+
     #======================== private =========================================
 
+    #=== jobs
+
+    def _call(self, callback, params):
+        if params:
+            callback(params)
+        else:
+            callback()
+
+    def _submit(self, command, callback, params):
+        with self.jobLock:
+            self.lastJobId  += 1
+            job              = Job(self.lastJobId, command)
+            self.jobs[job.id] = job
+        self.pool.apply_async(self._run_job, (job, callback, params))
+
+    def _run_job(self, job, callback, params):
+        try:
+            if job.cancelled():
+                return
+            job.status       = JOB_RUNNING
+            self.local.job   = job
+            self._call(callback, params)
+        except Exception as err:
+            self.log.error('job {0} ({1}) failed: {2}'.format(job.id, job.command, err))
+            print ' job {0} ({1}) failed: {2}'.format(job.id, job.command, err)
+        finally:
+            self.local.job   = None
+            with self.jobLock:
+                del self.jobs[job.id]
+
     def _register_command_internal(self, cmd_level, name, alias, description, params, callback):
 
         if self._does_command_exist(name):
@@ -222,8 +317,42 @@ class OpenCli(threading.Thread):
 
         print '\n'.join(output)
 
+    def _handle_jobs(self):
+        output  = []
+        with self.jobLock:
+            jobs = sorted(self.jobs.values(), key=lambda j: j.id)
+        output += ['{0} commands running:'.format(len(jobs))]
+        for job in jobs:
+            output += [' - [{0}] {1} ({2}{3}, {4:.1f}s)'.format(
+                job.id,
+                job.command,
+                job.status,
+                ', cancelled' if job.cancelled() else '',
+                time.time()-job.startTime,
+            )]
+        print '\n'.join(output)
+
+    def _handle_cancel(self, params):
+        try:
+            jobid = int(params[0])
+        except ValueError:
+            print ' invalid job id \''+params[0]+'\''
+            return
+        with self.jobLock:
+            job = self.jobs.get(jobid)
+        if job is None:
+            print ' no running command with id {0}'.format(jobid)
+            return
+        job.cancel()
+
     def _handle_quit(self):
 
+        # cancel the running commands
+        with self.jobLock:
+            for job in self.jobs.values():
+                job.cancel()
+        self.pool.close()
+
         # call the quit callback
         self.quit_cb()
 
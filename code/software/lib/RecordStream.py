@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import Queue
+import socket
+import struct
+import threading
+import collections
+
+BUFFER_SIZE        = 10000   # frames buffered per subscriber before the oldest are dropped
+FORWARD_QUEUE_SIZE = 10000   # frames buffered between a shard and the server
+
+FRAME_HEADER       = '>BH'   # record type, payload length
+FRAME_HEADER_LEN   = struct.calcsize(FRAME_HEADER)
+
+REC_SETTINGS       = 1       # JSON: the settings of the dataset being written
+REC_RX             = 2       # RX_FORMAT: one received frame
+REC_STEP           = 3       # JSON: summary of a transmitter step
+REC_DROPPED        = 4       # DROPPED_FORMAT: frames dropped for this subscriber since the last one
+
+RX_FORMAT          = '>d8B8BBbBBHH'  # timestamp, src, dst, channel, rssi, crc, expected, transctr, pkctr
+DROPPED_FORMAT     = '>I'
+
+
+class RecordStreamServer(threading.Thread):
+    """
+    Publishes reception records to local subscribers, over TCP
+    ("host:port") or a UNIX socket (a path).
+
+    Each subscriber has its own bounded buffer and sending thread: when a
+    subscriber does not keep up, its oldest frames are dropped and it
+    receives a REC_DROPPED frame with their number, so publishing never
+    blocks the receive path. The last header frame (see set_header()) is
+    sent first to every new subscriber.
+    """
+
+    def __init__(self, address, buffer_size=BUFFER_SIZE):
+
+        # slot params
+        self.address              = address
+        self.buffer_size          = buffer_size
+
+        # local variables
+        self.dataLock             = threading.Lock()
+        self.subscribers          = []
+        self.header               = None
+        self.goOn                 = True
+
+        if is_unix_address(address):
+            # a socket left behind by a server which is gone is replaced
+            if os.path.exists(address):
+                if _is_listening(address):
+                    raise SystemError('{0} is already used by another server'.format(address))
+                os.remove(address)
+            self.sock             = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.bind(address)
+        else:
+            self.sock             = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind(parse_tcp_address(address))
+        self.sock.listen(5)
+
+        threading.Thread.__init__(self)
+        self.name                 = 'RecordStreamServer@{0}'.format(address)
+        self.daemon               = True
+        self.start()
+
+    #======================== thread ==========================================
+
+    def run(self):
+        while self.goOn:
+            try:
+                (conn, _) = self.sock.accept()
+            except socket.error:
+                break
+            with self.dataLock:
+                self.subscribers  = [s for s in self.subscribers if s.isAlive()]
+                self.subscribers += [_Subscriber(conn, self.buffer_size, self.header)]
+
+    #======================== public ==========================================
+
+    def publish(self, frame):
+        with self.dataLock:
+            subscribers = self.subscribers
+        for s in subscribers:
+            s.push(frame)
+
+    def set_header(self, frame):
+        with self.dataLock:
+            self.header = frame
+        self.publish(frame)
+
+    def close(self):
+        self.goOn = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+        with self.dataLock:
+            subscribers = self.subscribers
+        for s in subscribers:
+            s.close()
+        if is_unix_address(self.address) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class _Subscriber(threading.Thread):
+
+    def __init__(self, conn, buffer_size, header):
+
+        # local variables
+        self.conn                 = conn
+        self.frames               = collections.deque(maxlen=buffer_size)
+        self.dataCond             = threading.Condition()
+        self.dropped              = 0
+        self.goOn                 = True
+
+        if header is not None:
+            self.frames.append(header)
+
+        threading.Thread.__init__(self)
+        self.name                 = 'RecordStreamSubscriber'
+        self.daemon               = True
+        self.start()
+
+    #======================== thread ==========================================
+
+    def run(self):
+        try:
+            while True:
+                with self.dataCond:
+                    while self.goOn and not self.frames:
+                        self.dataCond.wait()
+                    if not self.frames:
+                        break
+                    frames        = list(self.frames)
+                    self.frames.clear()
+                    if self.dropped:
+                        frames.insert(0, pack_dropped(self.dropped))
+                        self.dropped = 0
+                self.conn.sendall(''.join(frames))
+        except socket.error:
+            # the subscriber went away
+            pass
+        finally:
+            self.goOn = False
+            self.conn.close()
+
+    #======================== public ==========================================
+
+    def push(self, frame):
+        with self.dataCond:
+            if not self.goOn:
+                return
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(frame)
+            self.dataCond.notify()
+
+    def close(self):
+        with self.dataCond:
+            self.goOn = False
+            self.dataCond.notify()
+
+
+class QueuePublisher(object):
+    """
+    Publishes frames from a shard process to a ForwardingThread in the
+    coordinator. Frames are dropped when the queue is full.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def publish(self, frame):
+        try:
+            self.queue.put_nowait(frame)
+        except Queue.Full:
+            pass
+
+
+class ForwardingThread(threading.Thread):
+    """
+    Forwards the frames published by shard processes to a server.
+    """
+
+    def __init__(self, queue, server):
+
+        # slot params
+        self.queue                = queue
+        self.server               = server
+
+        threading.Thread.__init__(self)
+        self.name                 = 'RecordStreamForwarder'
+        self.daemon               = True
+        self.start()
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            self.server.publish(frame)
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+#============================ helpers =========================================
+
+
+def is_unix_address(address):
+    return '/' in address
+
+
+def parse_tcp_address(address):
+    (host, port) = address.rsplit(':', 1)
+    return (host or 'localhost', int(port))
+
+
+def _is_listening(address):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def connect(address):
+    """
+    :returns: a socket connected to a RecordStreamServer
+    """
+    if is_unix_address(address):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect(parse_tcp_address(address))
+    return sock
+
+
+def pack_frame(rec_type, payload):
+    return struct.pack(FRAME_HEADER, rec_type, len(payload))+payload
+
+
+def pack_json(rec_type, content):
+    return pack_frame(rec_type, json.dumps(content))
+
+
+def pack_rx(src, dst, channel, rssi, crc, expected, transctr, pkctr, timestamp=None):
+    if timestamp is None:
+        timestamp = time.time()
+    return pack_frame(REC_RX, struct.pack(
+        RX_FORMAT,
+        timestamp,
+        *(list(src)+list(dst)+[channel, rssi, crc, expected, transctr, pkctr])
+    ))
+
+
+def pack_dropped(num):
+    return pack_frame(REC_DROPPED, struct.pack(DROPPED_FORMAT, num))
+
+
+def read_records(f):
+    """
+    Decode the frames read from a file-like object, e.g. sock.makefile('rb').
+
+    :returns: a generator of (record type, content) tuples; the content is
+              a dictionary, or the number of dropped frames for REC_DROPPED
+    """
+    while True:
+        header = f.read(FRAME_HEADER_LEN)
+        if len(header) < FRAME_HEADER_LEN:
+            return
+        (rec_type, length) = struct.unpack(FRAME_HEADER, header)
+        payload = f.read(length)
+        if len(payload) < length:
+            return
+        if   rec_type == REC_RX:
+            fields = struct.unpack(RX_FORMAT, payload)
+            yield (rec_type, {
+                'timestamp':      fields[0],
+                'src':            fields[1:9],
+                'dst':            fields[9:17],
+                'channel':        fields[17],
+                'rssi':           fields[18],
+                'crc':            fields[19],
+                'expected':       fields[20],
+                'transctr':       fields[21],
+                'pkctr':          fields[22],
+            })
+        elif rec_type == REC_DROPPED:
+            yield (rec_type, struct.unpack(DROPPED_FORMAT, payload)[0])
+        else:
+            yield (rec_type, json.loads(payload))
@@ -0,0 +1,118 @@
+import math
+import array
+
+RSSI_MIN = -128   # RSSI is a signed byte in IND_RX
+RSSI_MAX = 127
+
+
+class RssiHistogram(object):
+    """
+    The number of packets received at each RSSI value of a link.
+
+    RSSI values are integers between RSSI_MIN and RSSI_MAX, so one bin per
+    value gives exact counts, mean and quantiles in bounded memory. Only
+    the bins between the lowest and highest values seen are allocated.
+    Histograms of the same link from several transactions, files or shards
+    are combined with merge().
+    """
+
+    __slots__ = ('lo', 'bins')
+
+    def __init__(self, rssis=()):
+        self.lo   = None
+        self.bins = array.array('I')
+        for rssi in rssis:
+            self.add(rssi)
+
+    #======================== public ==========================================
+
+    def add(self, rssi, num=1):
+        if not RSSI_MIN <= rssi <= RSSI_MAX:
+            raise ValueError('RSSI {0} out of range'.format(rssi))
+        if self.lo is None:
+            self.lo           = rssi
+            self.bins.append(0)
+        elif rssi < self.lo:
+            self.bins[0:0]    = array.array('I', [0]*(self.lo-rssi))
+            self.lo           = rssi
+        elif rssi >= self.lo+len(self.bins):
+            self.bins.extend([0]*(rssi-self.lo-len(self.bins)+1))
+        self.bins[rssi-self.lo] += num
+
+    def merge(self, other):
+        for (rssi, num) in other.items():
+            self.add(rssi, num)
+        return self
+
+    def items(self):
+        """
+        :returns: the (rssi, count) pairs of the non-empty bins, by increasing RSSI
+        """
+        return [(self.lo+i, n) for (i, n) in enumerate(self.bins) if n]
+
+    def count(self):
+        return sum(self.bins)
+
+    def mean(self):
+        count = self.count()
+        if not count:
+            return float('nan')
+        return sum([rssi*n for (rssi, n) in self.items()])/float(count)
+
+    def std(self):
+        count = self.count()
+        if not count:
+            return float('nan')
+        mean  = self.mean()
+        return math.sqrt(sum([n*(rssi-mean)**2 for (rssi, n) in self.items()])/float(count))
+
+    def quantile(self, q):
+        """
+        :returns: the lowest RSSI such that a fraction q of the packets were
+                  received at or below it, None without packets
+        """
+        rank = q*self.count()
+        seen = 0
+        for (rssi, n) in self.items():
+            seen += n
+            if seen >= rank:
+                return rssi
+        return None
+
+    def format(self):
+        """
+        :returns: the histogram as space-separated rssi:count pairs
+        """
+        return ' '.join(['{0}:{1}'.format(rssi, n) for (rssi, n) in self.items()])
+
+    @classmethod
+    def parse(cls, text):
+        returnval = cls()
+        for pair in text.split():
+            (rssi, n) = pair.split(':')
+            returnval.add(int(rssi), int(n))
+        return returnval
+
+    #======================== private =========================================
+
+    def __getstate__(self):
+        return (self.lo, self.bins.tolist())
+
+    def __setstate__(self, state):
+        (self.lo, bins) = state
+        self.bins       = array.array('I', bins)
+
+#============================ helpers =========================================
+
+
+def merge_all(histograms):
+    """
+    Merge dictionaries of histograms, e.g. one per link, from several sources.
+
+    :returns: a dictionary with the merged histogram of each key
+    """
+    returnval = {}
+    for histos in histograms:
+        for (key, h) in histos.items():
+            returnval.setdefault(key, RssiHistogram()).merge(h)
+    return returnval
@@ -0,0 +1,143 @@
+import os
+import time
+import struct
+import threading
+
+CAPTURE_MAGIC      = 'MERCAP1\n'
+CAPTURE_RESOLUTION = 0.001  # bytes received within this time share a timestamp, in s
+CAPTURE_MAXRECORD  = 4096   # maximum number of bytes in a record
+
+RECORD_HEADER      = '>dI'  # receive timestamp, number of bytes
+RECORD_HEADER_LEN  = struct.calcsize(RECORD_HEADER)
+
+
+class CaptureWriter(object):
+    """
+    Records the raw byte stream received from a mote, with receive
+    timestamps.
+
+    The file starts with CAPTURE_MAGIC, followed by records made of a
+    RECORD_HEADER (timestamp, length) and the bytes themselves. Bytes
+    received within CAPTURE_RESOLUTION of the first byte of a record are
+    stored in that record.
+    """
+
+    def __init__(self, filename):
+
+        self.filename             = filename
+        self.dataLock             = threading.Lock()
+        self.file                 = open(filename, 'wb')
+        self.recordTime           = None
+        self.recordBuf            = []
+        self.recordLen            = 0
+
+        self.file.write(CAPTURE_MAGIC)
+
+    #======================== public ==========================================
+
+    def write(self, data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.dataLock:
+            if (
+                    self.recordTime is not None and
+                    (
+                        timestamp-self.recordTime > CAPTURE_RESOLUTION or
+                        self.recordLen+len(data) > CAPTURE_MAXRECORD
+                    )
+                ):
+                self._flush()
+            if self.recordTime is None:
+                self.recordTime   = timestamp
+            self.recordBuf       += [data]
+            self.recordLen       += len(data)
+
+    def close(self):
+        with self.dataLock:
+            self._flush()
+            self.file.close()
+
+    #======================== private =========================================
+
+    def _flush(self):
+        if self.recordTime is None:
+            return
+        self.file.write(struct.pack(RECORD_HEADER, self.recordTime, self.recordLen))
+        self.file.write(''.join(self.recordBuf))
+        self.recordTime           = None
+        self.recordBuf            = []
+        self.recordLen            = 0
+
+
+class ReplaySource(object):
+    """
+    Feeds a capture back to a MoteHandler, in place of its serial port or
+    socket.
+
+    With speed=1.0, bytes are returned at the pace they were received;
+    speed=10.0 replays ten times faster; speed=None replays as fast as
+    possible. Everything sent to the mote is dropped. Reading returns an
+    empty string once the whole capture was replayed.
+    """
+
+    def __init__(self, filename, speed=1.0):
+
+        self.filename             = filename
+        self.speed                = speed
+        self.file                 = open(filename, 'rb')
+        self.buf                  = ''
+        self.pos                  = 0
+        self.firstTime            = None
+        self.startTime            = None
+
+        if self.file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise SystemError('{0} is not a capture file'.format(filename))
+
+    #======================== public ==========================================
+
+    def read(self, size=1):
+        if self.pos >= len(self.buf) and not self._next_record():
+            return ''
+        returnval  = self.buf[self.pos:self.pos+size]
+        self.pos  += len(returnval)
+        return returnval
+
+    recv = read
+
+    def write(self, data):
+        return len(data)
+
+    send = write
+
+    def close(self):
+        self.file.close()
+
+    #======================== private =========================================
+
+    def _next_record(self):
+        header = self.file.read(RECORD_HEADER_LEN)
+        if len(header) < RECORD_HEADER_LEN:
+            return False
+        (timestamp, length) = struct.unpack(RECORD_HEADER, header)
+        self.buf  = self.file.read(length)
+        self.pos  = 0
+
+        # wait until this record is due
+        if self.speed:
+            if self.firstTime is None:
+                self.firstTime = timestamp
+                self.startTime = time.time()
+            delay = self.startTime+(timestamp-self.firstTime)/self.speed-time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        return len(self.buf) > 0
+
+#============================ helpers =========================================
+
+
+def capture_filename(directory, serialport):
+    """
+    :returns: the name of the capture file of a mote in a directory
+    """
+    return os.path.join(directory, '{0}.cap'.format(serialport.replace('/', '_').strip('_')))
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+# =========================== adjust path =====================================
+
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'lib'))
+
+# =========================== imports =========================================
+
+import gzip
+import shutil
+import tempfile
+import unittest
+
+# Mercator
+import MoteGroup
+import MoteHandler
+import Notifications
+
+# =========================== helpers =========================================
+
+MACS = {
+    'mote1': (0x14, 0x15, 0x92, 0, 0, 0, 0, 1),
+    'mote2': (0x14, 0x15, 0x92, 0, 0, 0, 0, 2),
+    'mote3': (0x14, 0x15, 0x92, 0, 0, 0, 0, 3),
+}
+
+
+class FakeMote(object):
+    """
+    Stands for a MoteHandler: records the requests sent to the mote.
+    """
+
+    def __init__(self, serialport):
+        self.serialport           = serialport
+        self.requests             = []
+
+    def get_mac(self):
+        return MACS[self.serialport]
+
+    def send_REQ_IDLE(self):
+        self.requests            += ['idle']
+
+    def send_REQ_RX(self, **kwargs):
+        self.requests            += ['rx']
+
+    def close(self):
+        pass
+
+
+def fake_connect_motes(serialports, **kwargs):
+    return (dict([(sp, FakeMote(sp)) for sp in serialports]), {})
+
+
+def ind_rx(pkctr):
+    return Notifications.IndRx(length=100, rssi=-60, crc=1, expected=1, pkctr=pkctr)
+
+# =========================== tests ===========================================
+
+
+class TestQuarantine(unittest.TestCase):
+
+    def setUp(self):
+        self.connect_motes        = MoteHandler.connect_motes
+        MoteHandler.connect_motes = fake_connect_motes
+        self.tmpdir               = tempfile.mkdtemp()
+        self.filename             = os.path.join(self.tmpdir, 'dataset.csv.gz')
+        self.group                = MoteGroup.MoteGroup(sorted(MACS))
+        self.group.open_dataset(self.filename)
+
+    def tearDown(self):
+        MoteHandler.connect_motes = self.connect_motes
+        shutil.rmtree(self.tmpdir)
+
+    def _step(self, ports, src, transctr):
+        self.group.rx(
+            ports,
+            frequency             = 11,
+            srcmac                = MACS[src],
+            transctr              = transctr,
+            txpksize              = 100,
+            txfillbyte            = 0x0a,
+        )
+
+    def _rows(self):
+        self.group.close_dataset()
+        f = gzip.open(self.filename, 'rb')
+        try:
+            return [line.split(',') for line in f.read().splitlines()]
+        finally:
+            f.close()
+
+    def test_detached_mote_keeps_receiving(self):
+
+        # mote3 receives from mote1, then is quarantined
+        self._step(['mote2', 'mote3'], 'mote1', 0)
+        self.group._rx_cb('mote3', ind_rx(0))
+        self.group.detach(['mote3'])
+        self.assertEqual(self.group.motes['mote3'].requests, ['rx', 'idle'])
+
+        # the next step goes on without it, but it still receives
+        self._step(['mote1'], 'mote2', 1)
+        self.group._rx_cb('mote1', ind_rx(0))
+        self.group._rx_cb('mote3', ind_rx(1))
+
+        # src, dst, transaction_id of the rows
+        self.assertEqual(
+            [(row[1], row[2], row[7]) for row in self._rows()],
+            [
+                ('14-15-92-00-00-00-00-01', '14-15-92-00-00-00-00-03', '0'),
+                ('14-15-92-00-00-00-00-02', '14-15-92-00-00-00-00-01', '1'),
+            ],
+        )
+
+    def test_rx_takes_a_detached_mote_back(self):
+        self._step(['mote3'], 'mote1', 0)
+        self.group.detach(['mote3'])
+        self._step(['mote3'], 'mote2', 1)
+        self.group._rx_cb('mote3', ind_rx(0))
+        self.assertEqual(
+            [(row[1], row[2], row[7]) for row in self._rows()],
+            [('14-15-92-00-00-00-00-02', '14-15-92-00-00-00-00-03', '1')],
+        )
+
+if __name__ == '__main__':
+    unittest.main()